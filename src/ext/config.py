@@ -141,6 +141,21 @@ class Config(commands.GroupCog, group_name='config'):
         )
         await interaction.response.send_message(embed=embed, file=File('assets/dot.png', 'unknown.png'))
 
+    @command(name='xp_rate')
+    @describe(rate='The number of messages that earn XP per period', per='The length of the period in seconds')
+    @checks.has_permissions(administrator=True)
+    async def xp_rate(self, interaction: discord.Interaction, rate: Range[int, 1, 255], per: Range[int, 1, 86400]):
+        '''Modify how often messages earn XP'''
+        guild_conf = self.bot.guild_confs(interaction.guild)
+        await guild_conf.set('xp_rate', rate)
+        await guild_conf.set('xp_per', per)
+
+        embed = (
+            Embed(color=Color.primary)
+            .set_author(name=f'Messages now earn XP up to {rate} times per {per} seconds', icon_url='attachment://unknown.png')
+        )
+        await interaction.response.send_message(embed=embed, file=File('assets/dot.png', 'unknown.png'))
+
     @command(name='disable')
     @choices(option=[
         Choice(name='Welcome messages', value='welcome_message'),
@@ -110,6 +110,147 @@ class Developer(commands.Cog):
         )
         await interaction.response.send_message(embed=embed, file=File(f'assets/{color_name}dot.png', 'unknown.png'))
 
+    @command(name='stats')
+    @guilds(discord.Object(id=config.developer_guild_id))
+    async def stats(self, interaction: discord.Interaction):
+        '''Display internal cache and buffer metrics (developer use only)'''
+        members = self.bot.members
+        member_count = len(members)
+        bytes_per_member = members.nbytes / member_count if member_count else 0
+        xp_buffer = members.xp_buffer
+        xp_cooldown = self.bot.get_cog('Ranks').cooldown
+        reminders = self.bot.reminders
+        stars = self.bot.starboards.stars
+        editor = self.bot.starboards.editor
+        flights = self.bot.starboards.flights
+        starboard_messages = self.bot.starboards.messages
+        tags = self.bot.tags.cache
+        selections = self.bot.role_menus.selections
+        mod_records = self.bot.mod_records
+        embed = (
+            Embed(color=Color.primary)
+            .set_author(name='Stats', icon_url='attachment://unknown.png')
+            .add_field(
+                name='Member store',
+                value=(
+                    f'Members: `{member_count}`\n'
+                    f'Size: `{members.nbytes/1000/1000:.2f} MB`\n'
+                    f'Per member: `{bytes_per_member:.1f} B`'
+                )
+            )
+            .add_field(
+                name='XP buffer',
+                value=(
+                    f'Depth: `{xp_buffer.depth}`\n'
+                    f'Flushes: `{xp_buffer.flushes}`\n'
+                    f'Rows flushed: `{xp_buffer.flushed_rows}`\n'
+                    f'Last flush: `{xp_buffer.last_flush_latency*1000:.1f} ms`'
+                )
+            )
+            .add_field(
+                name='XP cooldown',
+                value=(
+                    f'Active: `{len(xp_cooldown)}`\n'
+                    f'Hits: `{xp_cooldown.hits}`\n'
+                    f'Limited: `{xp_cooldown.limited}`\n'
+                    f'Expiries: `{xp_cooldown.expiries}`'
+                )
+            )
+            .add_field(
+                name='Reminders',
+                value=(
+                    f'Pending: `{reminders.pending}`\n'
+                    f'Delivered: `{reminders.delivered}` in `{reminders.messages_sent}` messages\n'
+                    f'Lag: `{reminders.lag:.1f} s` (max `{reminders.max_lag:.1f} s`)'
+                )
+            )
+            .add_field(
+                name='Star counts',
+                value=(
+                    f'Cached: `{len(stars)}`\n'
+                    f'Hits: `{stars.hits}`\n'
+                    f'Misses: `{stars.misses}`'
+                )
+            )
+            .add_field(
+                name='Starboard messages',
+                value=(
+                    f'Cached: `{len(starboard_messages)}`\n'
+                    f'Hits: `{starboard_messages.hits}`\n'
+                    f'Misses: `{starboard_messages.misses}`'
+                )
+            )
+            .add_field(
+                name='Starboard edits',
+                value=(
+                    f'Pending: `{editor.pending}`\n'
+                    f'Applied: `{editor.edits}`\n'
+                    f'Saved: `{editor.edits_saved}`\n'
+                    f'Latency: `{editor.last_latency:.1f} s` (avg `{editor.average_latency:.1f} s`)'
+                )
+            )
+            .add_field(
+                name='Starboard posts',
+                value=(
+                    f'In flight: `{flights.in_flight}`\n'
+                    f'Calls: `{flights.calls}`\n'
+                    f'Shared: `{flights.shared}`'
+                )
+            )
+            .add_field(
+                name='Tag cache',
+                value=(
+                    f'Cached: `{len(tags)}`/`{tags.capacity}`\n'
+                    f'Hits: `{tags.hits}`\n'
+                    f'Misses: `{tags.misses}`\n'
+                    f'Hit rate: `{tags.hit_rate:.1%}`'
+                )
+            )
+            .add_field(
+                name='Role menus',
+                value=(
+                    f'Member edits: `{selections.edits}`\n'
+                    f'Coalesced: `{selections.coalesced}`'
+                )
+            )
+            .add_field(
+                name='Mod-log webhooks',
+                value=(
+                    f'Hits: `{mod_records.hits}`\n'
+                    f'Misses: `{mod_records.misses}`\n'
+                    f'Hit rate: `{mod_records.hit_rate:.1%}`\n'
+                    f'REST calls avoided: `{mod_records.hits}`'
+                )
+            )
+            .add_field(
+                name='Mod-log queue',
+                value=(
+                    f'Depth: `{mod_records.queue.total_depth}`\n'
+                    f'Delivered: `{mod_records.queue.delivered}` in `{mod_records.queue.messages}` messages\n'
+                    f'Dropped: `{mod_records.queue.dropped}`\n'
+                    f'Max guild latency: `{mod_records.queue.max_latency:.1f} s`'
+                )
+            )
+            .add_field(
+                name='Mod records',
+                value=(
+                    f'Cached: `{len(mod_records.records)}`/`{mod_records.records.capacity}`\n'
+                    f'Hits: `{mod_records.records.hits}`\n'
+                    f'Misses: `{mod_records.records.misses}`'
+                )
+            )
+            .add_field(
+                name='Message cache',
+                value=(
+                    f'Messages: `{len(mod_records.messages)}`\n'
+                    f'Size: `{mod_records.messages.nbytes/1000/1000:.2f}`/`{mod_records.messages.budget/1000/1000:.2f} MB`\n'
+                    f'Hit rate: `{mod_records.messages.hit_rate:.1%}`\n'
+                    f'Evictions: `{mod_records.messages.evictions}`'
+                )
+            )
+        )
+        await interaction.response.send_message(embed=embed, file=File('assets/dot.png', 'unknown.png'))
+
     @command(name='remove')
     @guilds(discord.Object(id=config.developer_guild_id))
     @describe(guild='The ID of the guild to be removed')
@@ -1,6 +1,8 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
+import io
+
 import discord
 from discord import Embed
 from discord.ext import commands
@@ -23,80 +25,140 @@ class ModRecords(commands.Cog):
         if channel.id == guild_conf.log_channel_id:
             await guild_conf.set('log_channel_id', None)
 
+    @commands.Cog.listener()
+    async def on_webhooks_update(self, channel: discord.abc.GuildChannel):
+        await self.bot.wait_until_synced()
+
+        if channel.id == self.bot.guild_confs(channel.guild).snapshot.log_channel_id:
+            self.bot.mod_records.invalidate(channel.guild.id)
+
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
-        webhook = await self.bot.mod_records.get_webhook(member.guild)
-        if webhook is not None:
+        await self.bot.wait_until_synced()
+
+        if self.bot.mod_records.enabled(member.guild):
             embed = (
                 Embed(title='Member join', color=Color.green)
                 .set_author(name=member, icon_url=member.avatar)
                 .set_footer(text=f'ID: {member.id}')
             )
-            await webhook.send(embed=embed)
+            self.bot.mod_records.log(member.guild, embed)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member):
-        webhook = await self.bot.mod_records.get_webhook(member.guild)
-        if webhook is not None:
+        await self.bot.wait_until_synced()
+
+        if self.bot.mod_records.enabled(member.guild):
             embed = (
                 Embed(title='Member leave', color=Color.red)
                 .set_author(name=member, icon_url=member.avatar)
                 .set_footer(text=f'ID: {member.id}')
             )
-            await webhook.send(embed=embed)
+            self.bot.mod_records.log(member.guild, embed)
 
     @commands.Cog.listener()
-    async def on_message_delete(self, message: discord.Message):
-        webhook = await self.bot.mod_records.get_webhook(message.guild)
-        if webhook is not None and webhook.channel != message.channel:
+    async def on_message(self, message: discord.Message):
+        if message.guild is None or message.webhook_id is not None or not self.bot.synced:
+            return
+
+        # Only what logging needs is kept, and only for guilds that log
+        log_channel_id = self.bot.guild_confs(message.guild).snapshot.log_channel_id
+        if log_channel_id is not None and log_channel_id != message.channel.id:
+            self.bot.mod_records.messages.add(message)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.guild_id is None:
+            return
+
+        await self.bot.wait_until_synced()
+
+        message = self.bot.mod_records.messages.pop(payload.guild_id, payload.message_id)
+        guild = self.bot.get_guild(payload.guild_id)
+        if message is None or guild is None:
+            return
+
+        log_channel_id = self.bot.guild_confs(guild).snapshot.log_channel_id
+        if log_channel_id is not None and log_channel_id != message.channel_id:
+            author = guild.get_member(message.author_id) or self.bot.get_user(message.author_id)
             embed = (
-                Embed(description=f'**Message deleted in {message.channel.mention}:**', color=Color.red)
-                .set_author(name=message.author, icon_url=message.author.avatar)
-                .set_footer(text=f'User ID: {message.author.id}')
+                Embed(description=f'**Message deleted in <#{message.channel_id}>:**', color=Color.red)
+                .set_author(name=author or message.author_id, icon_url=author.avatar if author is not None else None)
+                .set_footer(text=f'User ID: {message.author_id}')
             )
             if len(message.content) > 0:
                 embed.description += f'\n>>> {message.content}'
 
             file = None
-            if len(message.attachments) > 0:
-                attachment = message.attachments[0]
-                if attachment.url.lower().endswith(('png', 'jpeg', 'jpg', 'gif', 'webp')):
-                    file = await attachment.to_file(use_cached=True)
-                    embed.set_image(url=f'attachment://{file.filename}')
+            if message.image_url is not None:
+                try:
+                    data = await self.bot.http.get_from_cdn(message.image_url)
+                except discord.HTTPException:
+                    pass
+                else:
+                    # Several deleted messages may share a log message, so keep the file names apart
+                    filename = f'{message.id}_{message.image_url.rsplit("/", 1)[-1].split("?")[0]}'
+                    file = discord.File(io.BytesIO(data), filename)
+                    embed.set_image(url=f'attachment://{filename}')
+
+            self.bot.mod_records.log(guild, embed, file)
 
-            await webhook.send(file=file, embed=embed)
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        if payload.guild_id is None:
+            return
+
+        await self.bot.wait_until_synced()
+
+        for message_id in payload.message_ids:
+            self.bot.mod_records.messages.discard(payload.guild_id, message_id)
 
     @commands.Cog.listener()
-    async def on_message_edit(self, before: discord.Message, after: discord.Message):
-        if before.author.bot or before.content == after.content:
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        # Edits that don't change the content, e.g. embeds being resolved, don't include it
+        if payload.guild_id is None or 'content' not in payload.data:
             return
 
-        webhook = await self.bot.mod_records.get_webhook(before.guild)
-        if webhook is not None and webhook.channel != before.channel:
-            if len(before.content) > 1024 or len(after.content) > 1024:
-                embed = (
-                    Embed(title='Message edit', description=f'**Before**\n> {before.content}', color=Color.gold)
-                    .set_author(name=before.author, icon_url=before.author.avatar)
-                    .set_footer(text=f'User ID: {before.author.id}')
-                )
-                await webhook.send(embed=embed)
-
-                embed = (
-                    Embed(description=f'**After**\n> {after.content}', color=Color.gold)
-                    .add_field(name='Source', value=f'**[Jump!]({after.jump_url})**')
-                    .set_footer(text=f'User ID: {after.author.id}')
-                )
-                await webhook.send(embed=embed)
-            else:
-                embed = (
-                    Embed(title='Message edit', color=Color.gold)
-                    .set_author(name=after.author, icon_url=after.author.avatar)
-                    .add_field(name='Before', value=f'> {before.content}', inline=False)
-                    .add_field(name='After', value=f'> {after.content}', inline=False)
-                    .add_field(name='Source', value=f'**[Jump!]({after.jump_url})**')
-                    .set_footer(text=f'User ID: {before.author.id}')
-                )
-                await webhook.send(embed=embed)
+        await self.bot.wait_until_synced()
+
+        messages = self.bot.mod_records.messages
+        before = messages.get(payload.guild_id, payload.message_id)
+        guild = self.bot.get_guild(payload.guild_id)
+        if before is None or guild is None:
+            return
+
+        content = payload.data['content']
+        messages.put(payload.guild_id, payload.message_id, before.author_id, before.channel_id, content, before.image_url)
+
+        author = guild.get_member(before.author_id) or self.bot.get_user(before.author_id)
+        if author is None or author.bot or before.content == content:
+            return
+
+        jump_url = f'https://discord.com/channels/{guild.id}/{before.channel_id}/{before.id}'
+        if len(before.content) > 1024 or len(content) > 1024:
+            embed = (
+                Embed(title='Message edit', description=f'**Before**\n> {before.content}', color=Color.gold)
+                .set_author(name=author, icon_url=author.avatar)
+                .set_footer(text=f'User ID: {author.id}')
+            )
+            self.bot.mod_records.log(guild, embed)
+
+            embed = (
+                Embed(description=f'**After**\n> {content}', color=Color.gold)
+                .add_field(name='Source', value=f'**[Jump!]({jump_url})**')
+                .set_footer(text=f'User ID: {author.id}')
+            )
+            self.bot.mod_records.log(guild, embed)
+        else:
+            embed = (
+                Embed(title='Message edit', color=Color.gold)
+                .set_author(name=author, icon_url=author.avatar)
+                .add_field(name='Before', value=f'> {before.content}', inline=False)
+                .add_field(name='After', value=f'> {content}', inline=False)
+                .add_field(name='Source', value=f'**[Jump!]({jump_url})**')
+                .set_footer(text=f'User ID: {author.id}')
+            )
+            self.bot.mod_records.log(guild, embed)
 
 
 async def setup(bot: Tau):
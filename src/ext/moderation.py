@@ -161,19 +161,21 @@ class Moderation(commands.Cog):
     @guild_only()
     async def reason(self, interaction: discord.Interaction, message: Transform[discord.Message, MessageTransformer], reason: Range[str, 1, 1024]):
         '''Modify a reason of a mod action'''
+        # Editing both messages can take longer than the three seconds Discord allows for a response
+        await interaction.response.defer(ephemeral=True, thinking=True)
         result = await self.bot.mod_records.reason(message, reason)
         if not result:
             embed = (
                 Embed(color=Color.red)
                 .set_author(name='Failed to update reason', icon_url='attachment://unknown.png')
             )
-            await interaction.response.send_message(embed=embed, file=File('assets/reddot.png', 'unknown.png'), ephemeral=True)
+            await interaction.followup.send(embed=embed, file=File('assets/reddot.png', 'unknown.png'), ephemeral=True)
         else:
             embed = (
                 Embed(color=Color.primary)
                 .set_author(name='Reason has been updated', icon_url='attachment://unknown.png')
             )
-            await interaction.response.send_message(embed=embed, file=File('assets/dot.png', 'unknown.png'), ephemeral=True)
+            await interaction.followup.send(embed=embed, file=File('assets/dot.png', 'unknown.png'), ephemeral=True)
 
     @command(name='verify')
     @checks.has_permissions(manage_roles=True)
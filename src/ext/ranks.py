@@ -9,10 +9,11 @@ from discord.app_commands import guild_only, command, Range
 from discord.ext import commands
 
 from utils import Color, Emoji, DigitEmoji
-from utils.xp import Rank
+from utils.xp import Rank, XPCooldown
 
 if TYPE_CHECKING:
     from tau import Tau
+    from utils.xp import Ranks as Ranks_
 
 
 @guild_only()
@@ -20,7 +21,7 @@ class Ranks(commands.GroupCog, group_name='ranks'):
     '''Manage rank roles'''
     def __init__(self, bot: Tau):
         self.bot = bot
-        self._cooldown = commands.CooldownMapping.from_cooldown(10, 120.0, commands.BucketType.member)
+        self.cooldown = XPCooldown(rate=10, per=120)
 
         super().__init__()
 
@@ -28,60 +29,63 @@ class Ranks(commands.GroupCog, group_name='ranks'):
     async def on_message(self, message: discord.Message):
         member = message.author
         guild = message.guild
-        guild_conf = self.bot.guild_confs(guild)
-        if member.bot or guild is None or not guild_conf.leveling:
+        if member.bot or guild is None:
             return
 
         await self.bot.wait_until_synced()
 
+        guild_conf = self.bot.guild_confs(guild)
+        if not guild_conf.snapshot.leveling:
+            return
+
         if member not in self.bot.members:
             member_stats = await self.bot.members.add(member)
         else:
             member_stats = self.bot.members(member)
 
-        bucket = self._cooldown.get_bucket(message)
-        rate_limited = bucket.update_rate_limit()
-        if rate_limited is None:
+        if self.cooldown.hit(guild.id, member.id):
             # Add xp to user
             level = member_stats.xp.levels
             await member_stats.add_message_xp()
 
             # Rank roles
             new_level = member_stats.xp.levels
-            if guild_conf.ranks.enabled:
-                rank_roles = guild_conf.ranks.get_roles()
-                rank_levels = guild_conf.ranks.levels()
-
-                new_role = None
-                for rank, role in zip(reversed(guild_conf.ranks), reversed(rank_roles)):
-                    if new_level >= rank.level:
-                        new_role = role
-                        break
-
-                for role in rank_roles:
-                    if role in member.roles:
-                        await member.remove_roles(role)
-
-                if new_role not in member.roles:
-                    await member.add_roles(new_role)
-
+            ranks = guild_conf.ranks
+            if ranks.enabled:
                 # Level up
                 if new_level > level:
+                    rank = ranks.rank_for(level)
+                    new_rank = ranks.rank_for(new_level)
+                    ranked_up = new_rank is not None and (rank is None or new_rank.id != rank.id)
+                    if ranked_up:
+                        await self.apply_rank(member, ranks, new_rank)
+
                     await message.add_reaction(Emoji.level_up)
 
                     # Rank up
-                    if new_level in rank_levels:
+                    if ranked_up:
                         await message.add_reaction(Emoji.rank_up)
 
                     # Add digit emojis
                     for digit_emoji in DigitEmoji.from_int(new_level):
                         await message.add_reaction(digit_emoji)
 
+    @staticmethod
+    async def apply_rank(member: discord.Member, ranks: Ranks_, rank: Rank):
+        '''Swaps any other rank roles for the role of rank in a single request'''
+        role = member.guild.get_role(rank.id)
+        if role is None:
+            return
+
+        roles = [r for r in member.roles if not r.is_default() and r.id not in ranks.role_ids]
+        roles.append(role)
+        if len(roles) != len(member.roles) - 1 or role not in member.roles:
+            await member.edit(roles=roles)
+
     @commands.Cog.listener()
     async def on_guild_role_delete(self, role: discord.Role):
         guild_conf = self.bot.guild_confs(role.guild)
-        roles = guild_conf.ranks.get_roles()
-        if role in roles:
+        if role.id in guild_conf.ranks.role_ids:
             await guild_conf.ranks.remove(role)
 
     @command(name='view')
@@ -29,7 +29,7 @@ class RoleMenus(commands.GroupCog, group_name='role_menu'):
         await self.bot.wait_until_synced()
 
         message = discord.Object(id=payload.message_id)  # Fake discord.Message instance
-        if message.id in self.bot.role_menus.message_ids:
+        if message in self.bot.role_menus:
             await self.bot.role_menus.remove(message)
 
     @commands.Cog.listener()
@@ -81,6 +81,7 @@ class RoleMenus(commands.GroupCog, group_name='role_menu'):
             view.role_select.placeholder = placeholder
 
         await message.edit(embed=embed, view=view)
+        await self.bot.role_menus.update(view, message)
 
         await interaction.response.send_message(f'The role menu has been modified.', ephemeral=True)
 
@@ -108,6 +109,7 @@ class RoleMenus(commands.GroupCog, group_name='role_menu'):
         view.role_select.add_option(label=label if label else role.name, value=str(role.id), emoji=emoji, description=description)
 
         await message.edit(view=view)
+        await self.bot.role_menus.update(view, message)
 
         await interaction.response.send_message(f'Role {role} ({role.id}) has been added to the role menu.', ephemeral=True)
 
@@ -123,6 +125,7 @@ class RoleMenus(commands.GroupCog, group_name='role_menu'):
         view.role_select.remove_role(role)
 
         await message.edit(view=view)
+        await self.bot.role_menus.update(view, message)
 
         await interaction.response.send_message(f'Role {role} ({role.id}) has been removed from the role menu.', ephemeral=True)
 
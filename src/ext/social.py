@@ -11,7 +11,7 @@ from discord.ext import commands
 from discord.utils import escape_markdown
 
 from utils import Color, Emoji
-from utils.xp import Score
+from utils.xp import Score, XP
 
 if TYPE_CHECKING:
     from tau import Tau
@@ -112,6 +112,7 @@ class Social(commands.Cog):
             .set_author(name=member.display_name, icon_url=member.display_avatar.url)
             .add_field(name='Level', value=f'{member_stats.xp.levels} {Emoji.xp}')
             .add_field(name='Credits', value=f'{member_stats.credits} {Emoji.credits}')
+            .add_field(name='Rank', value=f'#{self.bot.members.rank(member)}')
         )
         await interaction.response.send_message(embed=embed)
 
@@ -148,16 +149,17 @@ class Social(commands.Cog):
 
     @app_commands.command(name='leaderboard')
     @app_commands.guild_only()
-    async def leaderboard(self, interaction: discord.Interaction):
+    async def leaderboard(self, interaction: discord.Interaction, page: app_commands.Range[int, 1] = 1):
         '''Display leaderboard'''
-        highscores: tuple[Score] = await self.bot.members.fetch_highscores()
+        highscores: tuple[Score] = await self.bot.members.fetch_highscores(interaction.guild, (page - 1) * 10)
         embed = (
             Embed(color=Color.primary)
             .set_author(name='Leaderboard', icon_url='attachment://unknown.png')
         )
-        for i, score in enumerate(highscores):
+        levels = XP.levels_of(score.xp.points for score in highscores)
+        for i, (score, level) in enumerate(zip(highscores, levels)):
             name = escape_markdown(str(score.member))
-            embed.add_field(name=f'{i+1}. {name}', value=f'**```yml\nLevel: {score.xp.levels}\nXP: {score.xp.points}```**', inline=i == 0)
+            embed.add_field(name=f'{score.position}. {name}', value=f'**```yml\nLevel: {level}\nXP: {score.xp.points}```**', inline=i == 0)
 
         await interaction.response.send_message(embed=embed, file=File('assets/dot.png', 'unknown.png'))
 
@@ -1,8 +1,6 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
-import asyncio
-
 import discord
 from discord.ext import commands
 
@@ -24,59 +22,89 @@ class Starboard_(commands.Cog, name='Starboard'):
         if channel.id == guild_conf.starboard_channel_id:
             await guild_conf.set('starboard_channel_id', None)
 
+    async def count_stars(self, channel: discord.TextChannel, message_id: int, delta: int) -> tuple[int, discord.Message | None] | None:
+        '''Returns the star count of a message and the message itself if it had to be fetched'''
+        stars = self.bot.starboards.stars.add(message_id, delta)
+        if stars is not None:
+            return stars, None
+
+        # Not cached, so seed the count from the message. The fetched count already includes this reaction.
+        try:
+            message = await channel.fetch_message(message_id)
+        except (discord.NotFound, discord.Forbidden):
+            return None
+
+        stars = Starboard.count_stars(message)
+        self.bot.starboards.stars.seed(message_id, stars)
+
+        return stars, message
+
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         if payload.member is None or str(payload.emoji) != '⭐':
             return
 
-        starboard = Starboard(self.bot, payload.member.guild)
+        await self.bot.wait_until_synced()
+
+        starboard = self.bot.starboards(payload.member.guild)
         channel = starboard.guild.get_channel(payload.channel_id)
         if starboard.channel is None or channel is None or starboard.channel == channel:
             return
 
-        try:
-            message = await channel.fetch_message(payload.message_id)
-        except (discord.NotFound, discord.Forbidden):
+        result = await self.count_stars(channel, payload.message_id, 1)
+        if result is None:
             return
 
-        stars = starboard.count_stars(message)
-
+        stars, message = result
         if stars < starboard.threshold:
             return
 
-        embed = starboard.embed(message)
-        star_emoji = starboard.star_emoji(stars)
-        starboard_message = await self.bot.starboards.fetch(message, starboard)
-        if starboard_message is not None:
-            await starboard_message.edit(f'{star_emoji} **{stars}**', embed=embed)
-        else:
-            async with asyncio.Lock():
-                starboard_message = await starboard.channel.send(f'{star_emoji} **{stars}**', embed=embed)
-                await self.bot.starboards.add(message, starboard_message)
+        starboards = self.bot.starboards
+        starboard_message, posted_stars = await starboards.flights(
+            payload.message_id, starboards.post, starboard, channel, payload.message_id, message, stars
+        )
+        # Reactions that joined someone else's post may have raised the count since
+        if starboard_message is not None and posted_stars != stars:
+            starboards.editor.schedule(starboard_message, f'{starboard.star_emoji(stars)} **{stars}**')
 
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
-        if payload.member is None or str(payload.emoji) != '⭐':
+        # payload.member is only provided for reaction adds
+        guild = self.bot.get_guild(payload.guild_id) if payload.guild_id is not None else None
+        if guild is None or str(payload.emoji) != '⭐':
             return
 
-        starboard = Starboard(self.bot, payload.member.guild)
+        await self.bot.wait_until_synced()
+
+        starboard = self.bot.starboards(guild)
         channel = starboard.guild.get_channel(payload.channel_id)
         if starboard.channel is None or channel is None or starboard.channel == channel:
             return
 
-        try:
-            message = await channel.fetch_message(payload.message_id)
-        except (discord.NotFound, discord.Forbidden):
+        result = await self.count_stars(channel, payload.message_id, -1)
+        if result is None:
             return
 
-        stars = starboard.count_stars(message)
-        embed = starboard.embed(message)
+        stars, _ = result
         star_emoji = starboard.star_emoji(stars)
+        message = discord.Object(id=payload.message_id)
         starboard_message = await self.bot.starboards.fetch(message, starboard)
+        # Starboard messages that no longer exist are forgotten by fetch
         if starboard_message is not None:
-            await starboard_message.edit(f'{star_emoji} **{stars}**', embed=embed)
-        else:
-            await self.bot.starboards.remove(message)
+            self.bot.starboards.editor.schedule(starboard_message, f'{star_emoji} **{stars}**')
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear(self, payload: discord.RawReactionClearEvent):
+        await self.bot.wait_until_synced()
+
+        self.bot.starboards.stars.clear(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear_emoji(self, payload: discord.RawReactionClearEmojiEvent):
+        if str(payload.emoji) == '⭐':
+            await self.bot.wait_until_synced()
+
+            self.bot.starboards.stars.clear(payload.message_id)
 
 
 async def setup(bot: Tau):
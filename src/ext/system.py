@@ -115,8 +115,7 @@ class System(commands.Cog):
     async def tag_make(self, interaction: discord.Interaction, name: str, message: Transform[discord.Message, MessageTransformer]):
         '''Make a tag'''
         # Make sure name isn't already a command or an alias
-        tag = self.bot.tags.get(interaction.guild, name.lower())
-        if tag is not None:
+        if name.lower() in self.bot.tags.index(interaction.guild.id):
             raise app_commands.AppCommandError
 
         # Get embed from message and convert JSON string
@@ -137,14 +136,18 @@ class System(commands.Cog):
     async def tag_get(self, interaction: discord.Interaction, name: str):
         '''Get a tag'''
         tag = await self.bot.tags.get(interaction.guild, name)
+        if tag is None:
+            embed = Embed(color=Color.red).set_author(name=f'Tag "{name}" does not exist', icon_url='attachment://unknown.png')
+            return await interaction.response.send_message(embed=embed, file=File('assets/reddot.png', 'unknown.png'), ephemeral=True)
 
         await interaction.response.send_message(tag.content, embed=tag.embed)
+        await self.bot.tags.use(tag)
 
     @staticmethod
     @tag_get.autocomplete('name')
     async def tag_autocomplete(interaction: discord.Interaction, current: str, namespace: app_commands.Namespace) -> list[Choice[str]]:
-        tags = interaction.client.tags.search(interaction.guild, current)
-        return [Choice(name=tag.name, value=tag.name) for tag in tags]
+        names = interaction.client.tags.search(interaction.guild, current.lower())
+        return [Choice(name=name, value=name) for name in names]
 
     @tag.command(name='delete')
     @app_commands.checks.has_permissions(manage_guild=True)
@@ -152,7 +155,7 @@ class System(commands.Cog):
     async def tag_delete(self, interaction: discord.Interaction, name: str):
         '''Delete a tag'''
         embed = Embed(color=Color.red)
-        if self.bot.tags.get(interaction.guild, name) is not None:
+        if name in self.bot.tags.index(interaction.guild.id):
             # If exists, delete
             await self.bot.tags.remove(interaction.guild, name)
 
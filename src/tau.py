@@ -53,13 +53,14 @@ class Tau(Bot):
             help_command=None,
             case_insensitive=True,
             intents=intents,
+            # Nothing relies on discord.py's message cache. Mod logging keeps its own compact cache of message content.
+            max_messages=None,
             tree_cls=CustomCommandTree
         )
 
         self.activity = Activity(name=f'/help', type=discord.ActivityType.listening)
         self.boot_time = discord.utils.utcnow()
         self.console = Console(tab_size=4, log_time_format='%m.%d.%y %I:%M %p', log_path=False)
-        self.mod_records = ModRecords(self)
         self._synced = asyncio.Event()
 
     @staticmethod
@@ -105,6 +106,7 @@ class Tau(Bot):
         self.reminders = await ReminderHandler(self)
         self.role_menus = await RoleMenuHandler(self)
         self.starboards = await StarboardHandler(self)
+        self.mod_records = await ModRecords(self)
         self.tags = await TagHandler(self)
 
         await self.tree.sync()
@@ -115,6 +117,14 @@ class Tau(Bot):
         self.console.log(f'{self.user.name} is online!')
         self.console.log(f'URL: {self.url}')
 
+    async def close(self):
+        try:
+            if self.synced:
+                # Final flush of buffered writes
+                await self.members.xp_buffer.close()
+        finally:
+            await super().close()
+
     async def wait_until_synced(self):
         await self._synced.wait()
 
@@ -1,19 +1,26 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Generic, Hashable, TypeVar
 
-from collections import deque
+import asyncio
+from collections import deque, OrderedDict
 from dataclasses import dataclass
 import json
+import time
 
 import aiohttp
 import discord
 from discord import Embed, File
 from discord import app_commands
 from discord.ext import commands
+from discord.utils import MISSING
 
 if TYPE_CHECKING:
     from tau import Tau
 
+T = TypeVar('T')
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
 
 class aobject:
     '''inheriting this class allows for async constructors.'''
@@ -24,6 +31,119 @@ class aobject:
         return instance
 
 
+class Reconciliation:
+    '''Tracks the rows pruned/added and the time spent in each phase while reconciling a table at start-up.'''
+    __slots__ = 'table', 'pruned', 'added', 'phases', '_start'
+
+    def __init__(self, table: str):
+        self.table: str = table
+        self.pruned: int = 0
+        self.added: int = 0
+        self.phases: dict[str, float] = {}  # phase -> seconds
+        self._start: float = time.perf_counter()
+
+    def phase(self, name: str):
+        '''Ends the current phase and starts timing the next one'''
+        now = time.perf_counter()
+        self.phases[name] = now - self._start
+        self._start = now
+
+    def log(self, bot: Tau):
+        timings = ', '.join(f'{name} {seconds*1000:.1f} ms' for name, seconds in self.phases.items())
+        bot.console.log(f'Reconciled {self.table}: {self.pruned} pruned, {self.added} added ({timings})')
+
+
+class SingleFlight:
+    '''Coalesces concurrent calls for the same key into a single in-flight call whose result is shared by every caller.
+
+    Entries only live while their call is in flight, so memory is bounded by the number of keys being worked on at once.
+    '''
+    __slots__ = '_flights', 'calls', 'shared'
+
+    def __init__(self):
+        self._flights: dict[Hashable, asyncio.Future] = {}  # key -> in-flight call
+
+        # Metrics
+        self.calls: int = 0
+        self.shared: int = 0  # Calls that joined a call already in flight
+
+    async def __call__(self, key: Hashable, func: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+        self.calls += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            # Run as a task so that a cancelled caller doesn't cancel the call for everyone sharing it
+            flight = asyncio.ensure_future(func(*args, **kwargs))
+            flight.add_done_callback(lambda _: self._land(key, flight))
+            self._flights[key] = flight
+        else:
+            self.shared += 1
+
+        return await asyncio.shield(flight)
+
+    def _land(self, key: Hashable, flight: asyncio.Future):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+
+class CacheMetrics:
+    '''Hit rate of a cache that counts its hits and misses.'''
+    __slots__ = ()
+
+    hits: int
+    misses: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class LRU(CacheMetrics, Generic[K, V]):
+    '''Bounded mapping that evicts its least recently used entry once it holds more than capacity entries.
+
+    Lookups of uncached keys return MISSING by default, so that None can be cached as a negative entry.
+    '''
+    __slots__ = '_entries', 'capacity', 'hits', 'misses'
+
+    def __init__(self, capacity: int):
+        self._entries: OrderedDict[K, V] = OrderedDict()  # Least recently used first
+        self.capacity: int = capacity
+
+        # Metrics
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, key: K, default: Any = MISSING) -> V | Any:
+        value = self._entries.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+
+        return value
+
+    def put(self, key: K, value: V):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def discard(self, key: K):
+        self._entries.pop(key, None)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
 class CustomCommandTree(app_commands.CommandTree):
     async def interaction_check(self, interaction: discord.Interaction, /) -> bool:
         bot: Tau = interaction.client
@@ -1,20 +1,38 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import Iterator, TYPE_CHECKING
+
+from dataclasses import dataclass
 
 import discord
-from discord.utils import find
 
-from . import aobject
+from . import aobject, Reconciliation
 from .xp import Ranks
 
 if TYPE_CHECKING:
     from tau import Tau
 
 
+@dataclass(frozen=True, slots=True)
+class GuildConfSnapshot:
+    '''A read-only copy of a guild's config, safe to hold across awaits in hot listeners.'''
+    id: int
+    welcome_message: str | None
+    goodbye_message: str | None
+    starboard_channel_id: int | None
+    starboard_threshold: int
+    autorole_id: int | None
+    verify_role_id: int | None
+    log_channel_id: int | None
+    leveling: bool
+    xp_rate: int | None
+    xp_per: int | None
+
+
 class GuildConf(aobject):
     __slots__ = (
         '_bot', '_id', 'welcome_message', 'goodbye_message', 'starboard_channel_id',
-        'starboard_threshold', 'autorole_id', 'verify_role_id', 'log_channel_id', 'leveling', '_ranks'
+        'starboard_threshold', 'autorole_id', 'verify_role_id', 'log_channel_id', 'leveling', 'xp_rate', 'xp_per',
+        '_ranks', '_snapshot'
     )
 
     async def __init__(
@@ -28,7 +46,11 @@ class GuildConf(aobject):
         autorole_id: int | None = None,
         verify_role_id: int | None = None,
         log_channel_id: int | None = None,
-        leveling: bool = False
+        leveling: bool = False,
+        xp_rate: int | None = None,
+        xp_per: int | None = None,
+        *,
+        ranks: Ranks | None = None
     ):
         # Checking if these values are still valid
         guild = bot.get_guild(id)
@@ -53,7 +75,12 @@ class GuildConf(aobject):
         self.log_channel_id: int | None = log_channel.id if log_channel is not None else None
 
         self.leveling: bool = leveling
-        self._ranks: Ranks = await Ranks(self._bot, self.id)
+        # Overrides of the XP cooldown, None for the default
+        self.xp_rate: int | None = xp_rate
+        self.xp_per: int | None = xp_per
+        self._apply_xp_rate()
+        self._ranks: Ranks = ranks if ranks is not None else await Ranks(self._bot, self.id)
+        self._snapshot: GuildConfSnapshot = self._take_snapshot()
 
     @property
     def id(self) -> int:
@@ -63,8 +90,41 @@ class GuildConf(aobject):
     def ranks(self) -> Ranks:
         return self._ranks
 
+    @property
+    def snapshot(self) -> GuildConfSnapshot:
+        return self._snapshot
+
+    def _take_snapshot(self) -> GuildConfSnapshot:
+        return GuildConfSnapshot(
+            self._id,
+            self.welcome_message,
+            self.goodbye_message,
+            self.starboard_channel_id,
+            self.starboard_threshold,
+            self.autorole_id,
+            self.verify_role_id,
+            self.log_channel_id,
+            self.leveling,
+            self.xp_rate,
+            self.xp_per
+        )
+
+    def _apply_xp_rate(self):
+        if self.xp_rate is not None or self.xp_per is not None:
+            cooldown = self._bot.get_cog('Ranks').cooldown
+            cooldown.set_rate(self.id, self.xp_rate or cooldown.rate, self.xp_per or cooldown.per)
+
     async def set(self, key: str, value: any):
         setattr(self, key, value)
+        self._snapshot = self._take_snapshot()
+        if key in ('starboard_channel_id', 'starboard_threshold'):
+            self._bot.starboards.invalidate(self.id)
+        elif key == 'log_channel_id':
+            self._bot.mod_records.invalidate(self.id)
+            if value is None:
+                self._bot.mod_records.messages.discard_guild(self.id)
+        elif key in ('xp_rate', 'xp_per'):
+            self._apply_xp_rate()
         async with self._bot.pool.acquire() as con:
             await con.execute(f'UPDATE guilds SET {key} = $1 WHERE id = $2', value, self.id)
 
@@ -77,6 +137,8 @@ class GuildConf(aobject):
         verify_role = guild.get_channel(self.verify_role_id)
         log_channel = guild.get_channel(self.log_channel_id)
         leveling = 'Enabled' if self.leveling else 'Disabled'
+        cooldown = self._bot.get_cog('Ranks').cooldown
+        xp_rate, xp_per = cooldown.get_rate(self.id)
 
         return {
             'Welcome message': clipped_welcome_message,
@@ -87,7 +149,8 @@ class GuildConf(aobject):
             'Autorole': autorole.mention if autorole is not None else None,
             'Verify role': verify_role.mention if verify_role is not None else None,
             'Log channel': log_channel.mention if log_channel is not None else None,
-            'Leveling': leveling
+            'Leveling': leveling,
+            'XP rate': f'{xp_rate} messages per {xp_per}s'
         }
 
     def _clip_str(self, string: str) -> str:
@@ -108,7 +171,9 @@ class GuildConf(aobject):
 
 class GuildHandler(aobject):
     __slots__ = '_bot'
-    guild_confs: list[GuildConf] = []
+    guild_confs: dict[int, GuildConf] = {}  # guild_id -> GuildConf
+
+    LOAD_CHUNK_SIZE = 500  # Rows fetched per round trip while loading configs
 
     async def __init__(self, bot: Tau):
         self._bot = bot
@@ -123,44 +188,70 @@ class GuildHandler(aobject):
         )
         async with self._bot.pool.acquire() as con:
             await con.execute(GUILD_SCHEMA)
+            await con.execute('ALTER TABLE guilds ADD COLUMN IF NOT EXISTS xp_rate smallint')
+            await con.execute('ALTER TABLE guilds ADD COLUMN IF NOT EXISTS xp_per integer')
             await con.execute(RANKS_SCHEMA)
 
-            # Check if guilds are still valid and fill the cache
-            records = await con.fetch('SELECT * FROM guilds')
-            for record in records:
-                guild_id = record['id']
-                guild = self._bot.get_guild(guild_id)
-                if guild is not None:
-                    guild_conf = await GuildConf(self._bot, *tuple(record))
-                    self.guild_confs.append(guild_conf)
-                else:
-                    await con.execute('DELETE FROM guilds WHERE id = $1', guild_id)
-
-        # Add any new guilds that were added while bot was offline
-        for guild in self._bot.guilds:
-            if guild not in self.guild_confs:
-                await self.add(guild)
+            # Check if guilds are still valid
+            reconciliation = Reconciliation('guilds')
+            stored_ids = {record['id'] for record in await con.fetch('SELECT id FROM guilds')}
+            reconciliation.phase('fetch')
+
+            stale_ids = [guild_id for guild_id in stored_ids if self._bot.get_guild(guild_id) is None]
+            # Guilds that were added while bot was offline
+            missing_ids = [guild.id for guild in self._bot.guilds if guild.id not in stored_ids]
+            reconciliation.phase('diff')
+
+            async with con.transaction():
+                if stale_ids:
+                    await con.execute('DELETE FROM guilds WHERE id = ANY($1::bigint[])', stale_ids)
+                if missing_ids:
+                    await con.execute('INSERT INTO guilds (id) SELECT unnest($1::bigint[])', missing_ids)
+                    await con.execute('INSERT INTO ranks (guild_id) SELECT unnest($1::bigint[])', missing_ids)
+            reconciliation.pruned = len(stale_ids)
+            reconciliation.added = len(missing_ids)
+            reconciliation.phase('apply')
+
+            # Fill the cache with a single streamed query for both configs and ranks
+            stmt = (
+                'SELECT guilds.*, ranks.role_ids, ranks.levels FROM guilds '
+                'LEFT JOIN ranks ON ranks.guild_id = guilds.id'
+            )
+            async with con.transaction():
+                async for record in con.cursor(stmt, prefetch=self.LOAD_CHUNK_SIZE):
+                    *columns, role_ids, levels = tuple(record)
+                    ranks = await Ranks(self._bot, record['id'], role_ids or [], levels or [])
+                    guild_conf = await GuildConf(self._bot, *columns, ranks=ranks)
+                    self.guild_confs[guild_conf.id] = guild_conf
+            reconciliation.phase('load')
+
+        reconciliation.log(self._bot)
 
     async def add(self, guild: discord.Guild):
-        guild_conf = await GuildConf(self._bot, guild.id)
-        self.guild_confs.append(guild_conf)
+        ranks = await Ranks(self._bot, guild.id, [], [])
+        guild_conf = await GuildConf(self._bot, guild.id, ranks=ranks)
+        self.guild_confs[guild_conf.id] = guild_conf
         async with self._bot.pool.acquire() as con:
             await con.execute('INSERT INTO guilds (id) VALUES ($1)', guild.id)
             await con.execute('INSERT INTO ranks (guild_id) VALUES ($1)', guild.id)
 
     async def remove(self, guild: discord.Guild):
-        self.guild_confs.remove(guild)
+        self.guild_confs.pop(guild.id, None)
+        self._bot.starboards.invalidate(guild.id)
+        self._bot.mod_records.invalidate(guild.id)
+        self._bot.mod_records.messages.discard_guild(guild.id)
+        self._bot.get_cog('Ranks').cooldown.discard(guild.id)
         async with self._bot.pool.acquire() as con:
             await con.execute('DELETE FROM guilds WHERE id = $1', guild.id)
 
     def get(self, guild: discord.Guild) -> GuildConf | None:
-        return find(lambda g: g == guild, self.guild_confs)
+        return self.guild_confs.get(guild.id)
 
     def __call__(self, guild: discord.Guild) -> GuildConf | None:
         return self.get(guild)
 
     def __contains__(self, guild: discord.Guild) -> bool:
-        return guild in self.guild_confs
+        return guild.id in self.guild_confs
 
-    def __iter__(self) -> list[GuildConf]:
-        return self.guild_confs
+    def __iter__(self) -> Iterator[GuildConf]:
+        return iter(self.guild_confs.values())
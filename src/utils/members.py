@@ -1,66 +1,350 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import Iterable, Iterator, TYPE_CHECKING
 
+from array import array
+import asyncio
+from bisect import bisect_left
+from collections import deque
 from dataclasses import dataclass
 import random
+import sys
+import time
 
 import discord
 from discord import Embed
-from discord.utils import find
+from discord.utils import find, MISSING
 
-from . import aobject, Color
-from .xp import Score, XP
+from . import aobject, CacheMetrics, Color, LRU, Reconciliation, SingleFlight
+from .messages import MessageCache
+from .xp import Leaderboard, Score, XP
 
 if TYPE_CHECKING:
     from tau import Tau
 
 
-@dataclass
+@dataclass(slots=True)
 class ModRecord:
-    message: discord.Message
-    record_message: discord.Message
+    guild_id: int
+    message_id: int  # The response to the mod action
+    record_message_id: int  # The mod-log message
+    index: int  # Index of the record's embed in the mod-log message, which may carry several
+    action: str
+    moderator_id: int
+    target_id: int
+    reason: str | None
+
+
+class ModRecordCache(LRU[tuple[int, int], ModRecord | None]):
+    '''Bounded LRU of recent mod records by source message, including negative entries for messages without one.'''
+    __slots__ = ()
+
+    def __init__(self, capacity: int = 1000):
+        super().__init__(capacity)  # (guild_id, message_id) -> record
+
+    def get(self, guild_id: int, message_id: int) -> ModRecord | None:
+        '''Returns the cached record, None for a negative entry, or MISSING if the message is not cached'''
+        return super().get((guild_id, message_id))
+
+    def put(self, guild_id: int, message_id: int, record: ModRecord | None):
+        super().put((guild_id, message_id), record)
+
+
+@dataclass(slots=True)
+class LogEntry:
+    embed: Embed
+    file: discord.File | None
+    future: asyncio.Future  # Resolves to (webhook message, embed index), or None if the entry wasn't delivered
+    queued: float
+    retried: bool = False
+
+
+class ModLogQueue:
+    '''Per-guild queues of mod-log embeds, each delivered through the guild's webhook up to 10 embeds per message.
+
+    Entries wait up to a short window so that bursts are packed together. A full queue drops its oldest entries, and
+    the number dropped is reported in the next message instead.
+    '''
+    __slots__ = '_records', '_queues', '_tasks', '_dropped', '_latency', 'window', 'max_depth', 'delivered', 'messages', 'dropped'
+
+    MAX_EMBEDS = 10  # Per webhook message
+    MAX_CHARS = 6000  # Across every embed in a message
+
+    def __init__(self, records: ModRecords, *, window: float = 1.0, max_depth: int = 200):
+        self._records: ModRecords = records
+        self._queues: dict[int, deque[LogEntry]] = {}  # guild_id -> entries waiting to be sent
+        self._tasks: dict[int, asyncio.Task] = {}  # guild_id -> task draining the queue
+        self._dropped: dict[int, int] = {}  # guild_id -> entries dropped since the last message
+        self._latency: dict[int, float] = {}  # guild_id -> seconds from queueing to delivery of the last message
+        self.window: float = window
+        self.max_depth: int = max_depth
+
+        # Metrics
+        self.delivered: int = 0
+        self.messages: int = 0
+        self.dropped: int = 0
+
+    def put(self, guild: discord.Guild, embed: Embed, file: discord.File | None = None) -> asyncio.Future:
+        queue = self._queues.setdefault(guild.id, deque())
+        if len(queue) >= self.max_depth:
+            # Overloaded, so the oldest entry makes room and is summarised instead
+            future = queue.popleft().future
+            if not future.done():
+                future.set_result(None)
+            self._dropped[guild.id] = self._dropped.get(guild.id, 0) + 1
+            self.dropped += 1
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append(LogEntry(embed, file, future, time.monotonic()))
+        if guild.id not in self._tasks:
+            self._tasks[guild.id] = asyncio.create_task(self._drain(guild))
+
+        return future
+
+    async def _drain(self, guild: discord.Guild):
+        queue = self._queues[guild.id]
+        batch: list[LogEntry] = []
+        try:
+            await asyncio.sleep(self.window)
+            while queue:
+                try:
+                    webhook = await self._records.get_webhook(guild)
+                except Exception:
+                    # e.g. Forbidden when the bot can't manage webhooks. Whatever is queued is dropped below.
+                    break
+                if webhook is None:
+                    # Logging was disabled while these were waiting
+                    break
+
+                embeds = []
+                dropped = self._dropped.pop(guild.id, 0)
+                if dropped:
+                    embeds.append(Embed(description=f'*{dropped} log entries were dropped while the log was overloaded*', color=Color.red))
+
+                batch = self._take(queue, len(embeds), sum(len(embed) for embed in embeds))
+                embeds += [entry.embed for entry in batch]
+                files = [entry.file for entry in batch if entry.file is not None]
+                try:
+                    message = await webhook.send(embeds=embeds, files=files, wait=True)
+                except Exception as error:
+                    if isinstance(error, discord.NotFound):
+                        # The webhook was deleted, so the retry gets a new one
+                        self._records.invalidate(guild.id)
+                    self._retry(guild.id, batch, dropped)
+                    batch = []
+                    await asyncio.sleep(self.window)
+                    continue
+
+                offset = len(embeds) - len(batch)
+                for i, entry in enumerate(batch):
+                    if not entry.future.done():
+                        entry.future.set_result((message, offset + i))
+
+                self.delivered += len(batch)
+                self.messages += 1
+                self._latency[guild.id] = time.monotonic() - batch[0].queued
+                batch = []
+        finally:
+            # Nothing may be left waiting, whether the queue was drained, dropped or the task failed
+            for entry in (*batch, *queue):
+                if not entry.future.done():
+                    entry.future.set_result(None)
+            queue.clear()
+            self._queues.pop(guild.id, None)
+            self._dropped.pop(guild.id, None)
+            del self._tasks[guild.id]
+
+    def _retry(self, guild_id: int, batch: list[LogEntry], dropped: int):
+        '''Puts a failed batch back at the front of its queue, once. Entries with files can't be sent twice.'''
+        queue = self._queues[guild_id]
+        for entry in reversed(batch):
+            if entry.retried or entry.file is not None:
+                if not entry.future.done():
+                    entry.future.set_result(None)
+            else:
+                entry.retried = True
+                queue.appendleft(entry)
+
+        if dropped:
+            self._dropped[guild_id] = self._dropped.get(guild_id, 0) + dropped
+
+    def _take(self, queue: deque[LogEntry], count: int, chars: int) -> list[LogEntry]:
+        '''Pops as many entries as fit into one message alongside count embeds totalling chars characters'''
+        batch = []
+        while queue and count < self.MAX_EMBEDS:
+            size = len(queue[0].embed)
+            if batch and chars + size > self.MAX_CHARS:
+                break
+            batch.append(queue.popleft())
+            count += 1
+            chars += size
+
+        return batch
+
+    def depth(self, guild_id: int) -> int:
+        queue = self._queues.get(guild_id)
+        return len(queue) if queue is not None else 0
+
+    def latency(self, guild_id: int) -> float:
+        return self._latency.get(guild_id, 0.0)
+
+    @property
+    def total_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def max_latency(self) -> float:
+        return max(self._latency.values(), default=0.0)
 
 
-class ModRecords:
-    __slots__ = '_bot',
-    _records: list[ModRecord]
+class ModRecords(aobject, CacheMetrics):
+    '''Mod logging through a webhook in each guild's log channel, and the records of mod actions for /reason.
 
-    def __init__(self, bot: Tau):
+    Webhooks are cached per guild and dropped when the log channel or its webhooks change. Records are stored in the
+    mod_records table with an LRU of recent records in front of it.
+    '''
+    __slots__ = '_bot', '_webhooks', '_avatar', '_flights', 'queue', 'records', 'messages', 'hits', 'misses'
+
+    async def __init__(self, bot: Tau):
         self._bot: Tau = bot
+        self.queue = ModLogQueue(self)
+        self.records = ModRecordCache()
+        self.messages = MessageCache()  # Content of recent messages, for edit and delete logs
+        self._webhooks: dict[int, discord.Webhook] = {}  # guild_id -> webhook
+        self._avatar: bytes | None = None  # The bot's avatar, used when creating webhooks
+        self._flights = SingleFlight()  # Keyed by guild_id
+
+        # Metrics
+        self.hits: int = 0  # Each hit is a channel.webhooks() call avoided
+        self.misses: int = 0
+
+        SCHEMA = (
+            'CREATE TABLE IF NOT EXISTS mod_records (guild_id bigint, message_id bigint, record_message_id bigint, '
+            'record_index smallint, action text, moderator_id bigint, target_id bigint, reason text, '
+            'created_at timestamptz DEFAULT now(), PRIMARY KEY (guild_id, message_id), '
+            'CONSTRAINT fk_guild FOREIGN KEY (guild_id) REFERENCES guilds(id) ON DELETE CASCADE)'
+        )
+        async with self._bot.pool.acquire() as con:
+            await con.execute(SCHEMA)
+
+    def enabled(self, guild: discord.Guild) -> bool:
+        return self._bot.guild_confs(guild).snapshot.log_channel_id is not None
+
+    def log(self, guild: discord.Guild, embed: Embed, file: discord.File | None = None) -> asyncio.Future:
+        '''Queues an embed for the guild's mod log, returning a future of the message it was sent in and its index'''
+        return self.queue.put(guild, embed, file)
+
+    async def _log_action(
+        self,
+        message: discord.Message,
+        embed: Embed,
+        action: str,
+        moderator: discord.abc.User,
+        target: discord.abc.Snowflake,
+        reason: str | None
+    ):
+        result = await self.log(message.guild, embed)
+        if result is not None:
+            record_message, index = result
+            record = ModRecord(message.guild.id, message.id, record_message.id, index, action, moderator.id, target.id, reason)
+            self.records.put(record.guild_id, record.message_id, record)
+            async with self._bot.pool.acquire() as con:
+                await con.execute(
+                    'INSERT INTO mod_records (guild_id, message_id, record_message_id, record_index, action, moderator_id, target_id, reason) '
+                    'VALUES ($1, $2, $3, $4, $5, $6, $7, $8)',
+                    record.guild_id, record.message_id, record.record_message_id, record.index,
+                    record.action, record.moderator_id, record.target_id, record.reason
+                )
+
+    async def get(self, guild: discord.Guild, message_id: int) -> ModRecord | None:
+        '''Returns the record of the mod action that message_id responded to'''
+        record = self.records.get(guild.id, message_id)
+        if record is not MISSING:
+            return record
+
+        async with self._bot.pool.acquire() as con:
+            row = await con.fetchrow(
+                'SELECT guild_id, message_id, record_message_id, record_index, action, moderator_id, target_id, reason '
+                'FROM mod_records WHERE guild_id = $1 AND message_id = $2',
+                guild.id, message_id
+            )
+
+        record = ModRecord(*row) if row is not None else None
+        self.records.put(guild.id, message_id, record)
+
+        return record
 
     async def get_webhook(self, guild: discord.Guild) -> discord.Webhook | None:
-        guild_conf = self._bot.guild_confs(guild)
-        if guild_conf.log_channel_id is not None:
-            channel = guild.get_channel(guild_conf.log_channel_id)
-            webhooks = await channel.webhooks()
-            webhook = find(lambda wh: wh.user == self._bot.user, webhooks)
-            if webhook is None:
-                avatar = self._bot.user.avatar.read()
-                webhook = await channel.create_webhook(name=self._bot.user.name, avatar=avatar, reason='Mod logging')
+        log_channel_id = self._bot.guild_confs(guild).snapshot.log_channel_id
+        if log_channel_id is None:
+            return None
 
+        webhook = self._webhooks.get(guild.id)
+        if webhook is not None and webhook.channel_id == log_channel_id:
+            self.hits += 1
             return webhook
 
-    async def reason(self, message: discord.Message, reason: str):
-        success = False
-        record = find(lambda record: record.message == message, self._records)
-        if record is not None:
-            result1 = await self._modify_reason(record.message, reason)
-            result2 = await self._modify_reason(record.record_message, reason)
+        self.misses += 1
+        return await self._flights(guild.id, self._fetch_webhook, guild, log_channel_id)
+
+    async def _fetch_webhook(self, guild: discord.Guild, log_channel_id: int) -> discord.Webhook | None:
+        channel = guild.get_channel(log_channel_id)
+        if channel is None:
+            return None
+
+        webhooks = await channel.webhooks()
+        webhook = find(lambda wh: wh.user == self._bot.user, webhooks)
+        if webhook is None:
+            webhook = await channel.create_webhook(name=self._bot.user.name, avatar=await self.avatar(), reason='Mod logging')
+
+        self._webhooks[guild.id] = webhook
+
+        return webhook
+
+    async def avatar(self) -> bytes | None:
+        if self._avatar is None and self._bot.user.avatar is not None:
+            self._avatar = await self._bot.user.avatar.read()
+
+        return self._avatar
 
-            self._records.remove(record)
+    def invalidate(self, guild_id: int):
+        '''Drops the cached webhook of a guild, called when its log channel or the channel's webhooks change'''
+        self._webhooks.pop(guild_id, None)
 
-            success = result1 and result2
+    async def reason(self, message: discord.Message, reason: str) -> bool:
+        record = await self.get(message.guild, message.id)
+        if record is None:
+            return False
 
-        return success
+        result1 = await self._modify_reason(message, reason)
+
+        # Webhook messages can only be edited through the webhook that sent them
+        result2 = False
+        webhook = await self.get_webhook(message.guild)
+        if webhook is not None:
+            try:
+                record_message = await webhook.fetch_message(record.record_message_id)
+            except discord.HTTPException:
+                pass
+            else:
+                result2 = await self._modify_reason(record_message, reason, record.index)
+
+        record.reason = reason
+        async with self._bot.pool.acquire() as con:
+            await con.execute(
+                'UPDATE mod_records SET reason = $3 WHERE guild_id = $1 AND message_id = $2', record.guild_id, record.message_id, reason
+            )
+
+        return result1 and result2
 
     @staticmethod
-    async def _modify_reason(message: discord.Message, reason) -> bool:
-        if len(message.embeds) == 1:
-            embed = message.embeds[0]
-            if len(embed.fields) == 1 and embed.fields[0].name == 'Reason':
+    async def _modify_reason(message: discord.Message, reason, index: int = 0) -> bool:
+        if index < len(message.embeds):
+            embeds = message.embeds
+            embed = embeds[index]
+            if embed.fields and embed.fields[0].name == 'Reason':
                 embed.set_field_at(0, name='Reason', value=f'{reason}')
                 try:
-                    await message.edit(embed=embed)
+                    await message.edit(embeds=embeds)
                 except discord.DiscordException:
                     return False
 
@@ -69,8 +353,7 @@ class ModRecords:
         return False
 
     async def log_ban(self, interaction: discord.Interaction, member: discord.Member, reason: str | None):
-        webhook = await self.get_webhook(member.guild)
-        if webhook is not None:
+        if self.enabled(interaction.guild):
             message = await interaction.original_message()
             embed = (
                 Embed(description=f'Banned {member}', title='Member ban', color=Color.red)
@@ -79,15 +362,10 @@ class ModRecords:
                 .add_field(name='Source', value=f'**[Jump!]({message.jump_url})**')
                 .set_footer(text=f'Banned user ID: {member.id}')
             )
-            record_message = await webhook.send(embed=embed, wait=True)
-
-            message = await interaction.original_message()
-            record = ModRecord(message, record_message)
-            self._records.append(record)
+            await self._log_action(message, embed, 'ban', interaction.user, member, reason)
 
     async def log_unban(self, interaction: discord.Interaction, member: discord.Member, reason: str | None):
-        webhook = await self.get_webhook(member.guild)
-        if webhook is not None:
+        if self.enabled(interaction.guild):
             message = await interaction.original_message()
             embed = (
                 Embed(description=f'Unbanned {member}', title='Member unban', color=Color.green)
@@ -96,15 +374,10 @@ class ModRecords:
                 .add_field(name='Source', value=f'**[Jump!]({message.jump_url})**')
                 .set_footer(text=f'Unbanned user ID: {member.id}')
             )
-            record_message = await webhook.send(embed=embed, wait=True)
-
-            message = await interaction.original_message()
-            record = ModRecord(message, record_message)
-            self._records.append(record)
+            await self._log_action(message, embed, 'unban', interaction.user, member, reason)
 
     async def log_blacklist(self, interaction: discord.Interaction, member: discord.Member, reason: str | None):
-        webhook = await self.get_webhook(member.guild)
-        if webhook is not None:
+        if self.enabled(interaction.guild):
             message = await interaction.original_message()
             embed = (
                 Embed(description=f'Blacklisted {member}', title='Member blacklist', color=Color.red)
@@ -113,15 +386,10 @@ class ModRecords:
                 .add_field(name='Source', value=f'**[Jump!]({message.jump_url})**')
                 .set_footer(text=f'Blacklisted user ID: {member.id}')
             )
-            record_message = await webhook.send(embed=embed, wait=True)
-
-            message = await interaction.original_message()
-            record = ModRecord(message, record_message)
-            self._records.append(record)
+            await self._log_action(message, embed, 'blacklist', interaction.user, member, reason)
 
     async def log_kick(self, interaction: discord.Interaction, member: discord.Member, reason: str | None):
-        webhook = await self.get_webhook(member.guild)
-        if webhook is not None:
+        if self.enabled(interaction.guild):
             message = await interaction.original_message()
             embed = (
                 Embed(description=f'Kicked {member}', title='Member kick', color=Color.red)
@@ -130,15 +398,10 @@ class ModRecords:
                 .add_field(name='Source', value=f'**[Jump!]({message.jump_url})**')
                 .set_footer(text=f'Kicked user ID: {member.id}')
             )
-            record_message = await webhook.send(embed=embed, wait=True)
-
-            message = await interaction.original_message()
-            record = ModRecord(message, record_message)
-            self._records.append(record)
+            await self._log_action(message, embed, 'kick', interaction.user, member, reason)
 
     async def log_mute(self, interaction: discord.Interaction, member: discord.Member, reason: str | None):
-        webhook = await self.get_webhook(member.guild)
-        if webhook is not None:
+        if self.enabled(interaction.guild):
             message = await interaction.original_message()
             embed = (
                 Embed(description=f'Muted {member}', title='Member mute', color=Color.red)
@@ -147,15 +410,10 @@ class ModRecords:
                 .add_field(name='Source', value=f'**[Jump!]({message.jump_url})**')
                 .set_footer(text=f'Muted user ID: {member.id}')
             )
-            record_message = await webhook.send(embed=embed, wait=True)
-
-            message = await interaction.original_message()
-            record = ModRecord(message, record_message)
-            self._records.append(record)
+            await self._log_action(message, embed, 'mute', interaction.user, member, reason)
 
     async def log_unmute(self, interaction: discord.Interaction, member: discord.Member, reason: str | None):
-        webhook = await self.get_webhook(member.guild)
-        if webhook is not None:
+        if self.enabled(interaction.guild):
             message = await interaction.original_message()
             embed = (
                 Embed(description=f'Unmuted {member}', title='Member unmute', color=Color.red)
@@ -164,15 +422,10 @@ class ModRecords:
                 .add_field(name='Source', value=f'**[Jump!]({message.jump_url})**')
                 .set_footer(text=f'Unmuted user ID: {member.id}')
             )
-            record_message = await webhook.send(embed=embed, wait=True)
-
-            message = await interaction.original_message()
-            record = ModRecord(message, record_message)
-            self._records.append(record)
+            await self._log_action(message, embed, 'unmute', interaction.user, member, reason)
 
     async def log_warn(self, interaction: discord.Interaction, member: discord.Member, reason: str | None):
-        webhook = await self.get_webhook(member.guild)
-        if webhook is not None:
+        if self.enabled(interaction.guild):
             message = await interaction.original_message()
             embed = (
                 Embed(description=f'Warned {member}', title='Member warn', color=Color.gold)
@@ -181,15 +434,10 @@ class ModRecords:
                 .add_field(name='Source', value=f'**[Jump!]({message.jump_url})**')
                 .set_footer(text=f'Warned user ID: {member.id}')
             )
-            record_message = await webhook.send(embed=embed, wait=True)
-
-            message = await interaction.original_message()
-            record = ModRecord(message, record_message)
-            self._records.append(record)
+            await self._log_action(message, embed, 'warn', interaction.user, member, reason)
 
     async def log_verify(self, interaction: discord.Interaction, member: discord.Member):
-        webhook = await self.get_webhook(member.guild)
-        if webhook is not None:
+        if self.enabled(interaction.guild):
             message = await interaction.original_message()
             embed = (
                 Embed(description=f'Verified {member}', title='Member verify', color=Color.green)
@@ -197,15 +445,10 @@ class ModRecords:
                 .add_field(name='Source', value=f'**[Jump!]({message.jump_url})**')
                 .set_footer(text=f'Verified user ID: {member.id}')
             )
-            record_message = await webhook.send(embed=embed, wait=True)
-
-            message = await interaction.original_message()
-            record = ModRecord(message, record_message)
-            self._records.append(record)
+            await self._log_action(message, embed, 'verify', interaction.user, member, None)
 
     async def log_unverify(self, interaction: discord.Interaction, member: discord.Member, reason: str | None):
-        webhook = await self.get_webhook(member.guild)
-        if webhook is not None:
+        if self.enabled(interaction.guild):
             message = await interaction.original_message()
             embed = (
                 Embed(description=f'Unverified {member}', title='Member unverify', color=Color.red)
@@ -214,61 +457,230 @@ class ModRecords:
                 .add_field(name='Source', value=f'**[Jump!]({message.jump_url})**')
                 .set_footer(text=f'Unverified user ID: {member.id}')
             )
-            record_message = await webhook.send(embed=embed, wait=True)
+            await self._log_action(message, embed, 'unverify', interaction.user, member, reason)
 
-            message = await interaction.original_message()
-            record = ModRecord(message, record_message)
-            self._records.append(record)
+
+class XPBuffer:
+    '''Write-behind buffer for XP deltas, flushed to the database in a single set-based UPDATE.'''
+    __slots__ = (
+        '_bot', '_deltas', '_lock', '_wakeup', '_task', '_closing', 'interval', 'max_size', 'flushes', 'flushed_rows', 'last_flush_latency'
+    )
+
+    def __init__(self, bot: Tau, *, interval: float = 10.0, max_size: int = 1000):
+        self._bot: Tau = bot
+        self._deltas: dict[tuple[int, int], int] = {}  # (guild_id, member_id) -> pending points
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closing: bool = False
+        self.interval: float = interval
+        self.max_size: int = max_size
+
+        # Metrics
+        self.flushes: int = 0
+        self.flushed_rows: int = 0
+        self.last_flush_latency: float = 0.0  # Seconds
+
+    @property
+    def depth(self) -> int:
+        return len(self._deltas)
+
+    def add(self, member_stats: MemberStats, points: int):
+        key = (member_stats.guild_id, member_stats.id)
+        self._deltas[key] = self._deltas.get(key, 0) + points
+        if len(self._deltas) >= self.max_size:
+            self._wakeup.set()
+
+    def discard(self, guild_id: int, member_id: int):
+        self._deltas.pop((guild_id, member_id), None)
+
+    async def flush(self):
+        async with self._lock:
+            if not self._deltas:
+                return
+
+            deltas, self._deltas = self._deltas, {}
+            guild_ids = [guild_id for guild_id, _ in deltas]
+            member_ids = [member_id for _, member_id in deltas]
+            points = list(deltas.values())
+
+            start = time.perf_counter()
+            try:
+                async with self._bot.pool.acquire() as con:
+                    stmt = (
+                        'UPDATE members SET xp_points = members.xp_points + d.points '
+                        'FROM unnest($1::bigint[], $2::bigint[], $3::bigint[]) AS d(id, guild_id, points) '
+                        'WHERE members.id = d.id AND members.guild_id = d.guild_id'
+                    )
+                    await con.execute(stmt, member_ids, guild_ids, points)
+            except BaseException:
+                # Merge the deltas back so that nothing is lost
+                for key, value in deltas.items():
+                    self._deltas[key] = self._deltas.get(key, 0) + value
+                raise
+
+            self.last_flush_latency = time.perf_counter() - start
+            self.flushes += 1
+            self.flushed_rows += len(deltas)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        '''Stops the flush loop and writes any remaining deltas'''
+        # Cancelling could interrupt an UPDATE the server has already committed, whose deltas would then be written twice.
+        # The loop is woken up instead and allowed to finish its last flush.
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+        await self.flush()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as err:
+                self._bot.console.log(f'XP flush failed: {err}', style='red')
+
+
+class MemberStore:
+    '''Column-oriented storage for the stats of every tracked member of a guild, sorted by member ID.'''
+    __slots__ = 'guild_id', 'ids', 'xp_points', 'credits'
+
+    def __init__(self, guild_id: int, rows: Iterable[tuple[int, int, int]] = ()):
+        rows = sorted(rows)
+        self.guild_id: int = guild_id
+        self.ids: array[int] = array('q', (id for id, _, _ in rows))
+        self.xp_points: array[int] = array('q', (xp_points for _, xp_points, _ in rows))
+        self.credits: array[int] = array('q', (credits for _, _, credits in rows))
+
+    def index(self, member_id: int) -> int | None:
+        i = bisect_left(self.ids, member_id)
+        if i < len(self.ids) and self.ids[i] == member_id:
+            return i
+
+    def add(self, member_id: int, xp_points: int = 0, credits: int = 0) -> bool:
+        '''Adds a member and returns whether they weren't stored already'''
+        i = bisect_left(self.ids, member_id)
+        if i < len(self.ids) and self.ids[i] == member_id:
+            return False
+
+        self.ids.insert(i, member_id)
+        self.xp_points.insert(i, xp_points)
+        self.credits.insert(i, credits)
+        return True
+
+    def remove(self, member_id: int) -> tuple[int, int] | None:
+        '''Removes a member and returns their (xp_points, credits)'''
+        i = self.index(member_id)
+        if i is not None:
+            del self.ids[i]
+            return self.xp_points.pop(i), self.credits.pop(i)
+
+    @property
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.ids) + sys.getsizeof(self.xp_points) + sys.getsizeof(self.credits)
+
+    def __contains__(self, member_id: int) -> bool:
+        return self.index(member_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.ids)
 
 
 class MemberStats:
-    __slots__ = '_bot', '_id', 'guild_id', 'xp', 'credits'
+    '''A lightweight view of a single member's row in a MemberStore.'''
+    __slots__ = '_bot', '_store', '_id'
 
-    def __init__(self, bot: Tau, id: int, guild_id: int, xp_points: int = 0, credits: int = 0):
+    def __init__(self, bot: Tau, store: MemberStore, id: int):
         self._bot: Tau = bot
+        self._store: MemberStore = store
         self._id: int = id
-        self.guild_id: int = guild_id
-        self.xp: XP = XP(xp_points)
-        self.credits: int = credits
 
     @property
     def id(self) -> int:
         return self._id
 
+    @property
+    def guild_id(self) -> int:
+        return self._store.guild_id
+
     # For easy comparison using __eq__
     @property
     def guild(self) -> discord.Object:
         return discord.Object(id=self.guild_id)
 
+    @property
+    def xp(self) -> XP:
+        i = self._store.index(self._id)
+        return XP(self._store.xp_points[i] if i is not None else 0)
+
+    @property
+    def credits(self) -> int:
+        i = self._store.index(self._id)
+        return self._store.credits[i] if i is not None else 0
+
     async def add_xp(self, points: int):
-        self.xp.points += points
-        async with self._bot.pool.acquire() as con:
-            await con.execute('UPDATE members SET xp_points = $1 WHERE id = $2 AND guild_id = $3', self.xp.points, self._id, self.guild_id)
+        i = self._store.index(self._id)
+        if i is None:
+            return
+
+        old_points = self._store.xp_points[i]
+        self._store.xp_points[i] = old_points + points
+        self._bot.members.rerank(self, old_points)
+        self._bot.members.xp_buffer.add(self, points)
 
     async def add_message_xp(self):
         points = random.randint(1, 5)
         await self.add_xp(points)
 
     async def set_xp(self, points: int):
-        self.xp.points = points
+        # Write out pending deltas first so they aren't applied on top of the new value
+        await self._bot.members.xp_buffer.flush()
+        self._bot.members.xp_buffer.discard(self.guild_id, self._id)
+
+        i = self._store.index(self._id)
+        if i is None:
+            return
+
+        old_points = self._store.xp_points[i]
+        self._store.xp_points[i] = points
+        self._bot.members.rerank(self, old_points)
         async with self._bot.pool.acquire() as con:
-            await con.execute('UPDATE members SET xp_points = $1 WHERE id = $2 AND guild_id = $3', self.xp.points, self._id, self.guild_id)
+            await con.execute('UPDATE members SET xp_points = $1 WHERE id = $2 AND guild_id = $3', points, self._id, self.guild_id)
 
     async def add_credits(self, credits: int):
-        self.credits += credits
+        i = self._store.index(self._id)
+        if i is None:
+            return
+
+        # Read before awaiting, since members joining meanwhile shift the row
+        new_credits = self._store.credits[i] = self._store.credits[i] + credits
         async with self._bot.pool.acquire() as con:
-            await con.execute('UPDATE members SET credits = $1 WHERE id = $2 AND guild_id = $3', self.credits, self._id, self.guild_id)
+            await con.execute('UPDATE members SET credits = $1 WHERE id = $2 AND guild_id = $3', new_credits, self._id, self.guild_id)
 
     def __eq__(self, other: discord.Member | MemberStats) -> bool:
-        return self.id is other.id and self.guild.id is other.guild.id
+        return self.id == other.id and self.guild.id == other.guild.id
 
 
 class MemberTracker(aobject):
-    __slots__ = '_bot',
-    member_stats: list[MemberStats] = []
+    __slots__ = '_bot', 'xp_buffer'
+    stores: dict[int, MemberStore] = {}  # guild_id -> MemberStore
+    leaderboards: dict[int, Leaderboard] = {}  # guild_id -> Leaderboard
 
     async def __init__(self, bot: Tau):
         self._bot = bot
+        self.xp_buffer = XPBuffer(bot)
         MEMBERS_SCHEMA = (
             'CREATE TABLE IF NOT EXISTS members (id bigint, guild_id bigint, xp_points bigint DEFAULT 0, credits bigint DEFAULT 0, '
             'CONSTRAINT fk_guild FOREIGN KEY (guild_id) REFERENCES guilds(id) ON DELETE CASCADE)'
@@ -277,54 +689,144 @@ class MemberTracker(aobject):
             await con.execute(MEMBERS_SCHEMA)
 
             # Check if members still exist and fill the cache
-            records = await con.fetch('SELECT * FROM members ORDER BY guild_id')
-            if len(records) > 0:
-                guild = self._bot.get_guild(records[0]['guild_id'])
-                for record in records:
-                    guild_id: int = record['guild_id']
-                    if guild.id != guild_id:
-                        guild = self._bot.get_guild(guild_id)
-
-                    member = guild.get_member(record['id'])
-                    if member:
-                        member_stats = MemberStats(self._bot, *tuple(record))
-                        self.member_stats.append(member_stats)
-                    else:
-                        await con.execute('DELETE FROM members WHERE id = $1 AND guild_id = $2', member.id, guild.id)
+            reconciliation = Reconciliation('members')
+            records = await con.fetch('SELECT * FROM members')
+            reconciliation.phase('fetch')
+
+            rows: dict[int, list[tuple[int, int, int]]] = {}  # guild_id -> [(id, xp_points, credits)]
+            stale_ids: list[int] = []
+            stale_guild_ids: list[int] = []
+            for id, guild_id, xp_points, credits in records:
+                guild = self._bot.get_guild(guild_id)
+                if guild is not None and guild.get_member(id) is not None:
+                    rows.setdefault(guild_id, []).append((id, xp_points, credits))
+                else:
+                    stale_ids.append(id)
+                    stale_guild_ids.append(guild_id)
+            del records
+            reconciliation.phase('diff')
+
+            if stale_ids:
+                stmt = 'DELETE FROM members WHERE (id, guild_id) IN (SELECT * FROM unnest($1::bigint[], $2::bigint[]))'
+                await con.execute(stmt, stale_ids, stale_guild_ids)
+            reconciliation.pruned = len(stale_ids)
+            reconciliation.phase('apply')
+
+        for guild_id, guild_rows in rows.items():
+            store = MemberStore(guild_id, guild_rows)
+            self.stores[guild_id] = store
+            self.leaderboards[guild_id] = Leaderboard(zip(store.ids, store.xp_points))
+        reconciliation.phase('index')
+
+        reconciliation.log(self._bot)
+
+        self.xp_buffer.start()
 
     async def add(self, member: discord.Member) -> MemberStats:
-        member_stats = MemberStats(self._bot, member.id, member.guild.id)
-        self.member_stats.append(member_stats)
-        async with self._bot.pool.acquire() as con:
-            await con.execute('INSERT INTO members (id, guild_id) VALUES ($1, $2)', member.id, member.guild.id)
+        store = self.stores.get(member.guild.id)
+        if store is None:
+            store = self.stores[member.guild.id] = MemberStore(member.guild.id)
+            self.leaderboards[member.guild.id] = Leaderboard()
+
+        # Members that are already stored already have a row, and members has no key to reject a duplicate
+        if store.add(member.id):
+            self.leaderboards[member.guild.id].add(member.id, 0)
+            async with self._bot.pool.acquire() as con:
+                await con.execute('INSERT INTO members (id, guild_id) VALUES ($1, $2)', member.id, member.guild.id)
 
-        return member_stats
+        return MemberStats(self._bot, store, member.id)
 
     async def remove(self, member: discord.Member):
-        self.member_stats.remove(member)
+        self._discard(member.guild.id, member.id)
         async with self._bot.pool.acquire() as con:
             await con.execute('DELETE FROM members WHERE id = $1 AND guild_id = $2', member.id, member.guild.id)
 
-    def get(self, member: discord.Member) -> MemberStats | None:
-        return find(lambda ms: ms == member, self.member_stats)
+    def _discard(self, guild_id: int, member_id: int):
+        store = self.stores.get(guild_id)
+        if store is not None:
+            removed = store.remove(member_id)
+            if removed is not None:
+                xp_points, _ = removed
+                self.leaderboards[guild_id].remove(member_id, xp_points)
+            if len(store) == 0:
+                del self.stores[guild_id]
+                del self.leaderboards[guild_id]
+
+        self.xp_buffer.discard(guild_id, member_id)
 
-    async def fetch_highscores(self, guild: discord.Guild) -> tuple[Score]:
+    def get(self, member: discord.Member) -> MemberStats | None:
+        store = self.stores.get(member.guild.id)
+        if store is not None and member.id in store:
+            return MemberStats(self._bot, store, member.id)
+
+    def guild_members(self, guild: discord.Guild) -> tuple[MemberStats]:
+        '''Returns the tracked members of a single guild'''
+        store = self.stores.get(guild.id)
+        if store is None:
+            return ()
+
+        return tuple(MemberStats(self._bot, store, id) for id in store.ids)
+
+    def rerank(self, member_stats: MemberStats, old_points: int):
+        '''Moves a member to their new position on the leaderboard after an XP change'''
+        leaderboard = self.leaderboards.get(member_stats.guild_id)
+        if leaderboard is not None:
+            leaderboard.update(member_stats.id, old_points, member_stats.xp.points)
+
+    def rank(self, member: discord.Member) -> int | None:
+        '''Returns the one-based leaderboard position of a member'''
+        member_stats = self.get(member)
+        if member_stats is not None:
+            position = self.leaderboards[member.guild.id].rank(member.id, member_stats.xp.points)
+            if position is not None:
+                return position + 1
+
+    async def fetch_highscores(self, guild: discord.Guild, offset: int = 0, count: int = 10) -> tuple[Score]:
+        '''Returns the scores from leaderboard position offset on, pruning members who left without being removed'''
         scores: list[Score] = []
-        async with self._bot.pool.acquire() as con:
-            async for id, xp_points in con.cursor('SELECT id, xp_points FROM members WHERE guild_id = $1 ORDER BY xp_points DESC', guild.id):
+        stale_ids: list[int] = []
+        leaderboard = self.leaderboards.get(guild.id)
+        while leaderboard is not None and len(scores) < count:
+            entries = leaderboard.page(offset + len(scores), count - len(scores))
+            if not entries:
+                break
+
+            for id, xp_points in entries:
                 member = guild.get_member(id)
                 if member is not None:
-                    scores.append(Score(member, XP(xp_points)))
-                    if len(scores) == 10:
-                        break
+                    # Pruned members are gone from the leaderboard, so positions stay contiguous
+                    scores.append(Score(member, XP(xp_points), offset + len(scores) + 1))
+                else:
+                    self._discard(guild.id, id)
+                    stale_ids.append(id)
+
+            leaderboard = self.leaderboards.get(guild.id)
+
+        if stale_ids:
+            async with self._bot.pool.acquire() as con:
+                await con.execute('DELETE FROM members WHERE id = ANY($1::bigint[]) AND guild_id = $2', stale_ids, guild.id)
 
         return tuple(scores)
 
+    @property
+    def nbytes(self) -> int:
+        '''Bytes held by the member stat columns and the leaderboards'''
+        return (
+            sum(store.nbytes for store in self.stores.values())
+            + sum(leaderboard.nbytes for leaderboard in self.leaderboards.values())
+        )
+
     def __call__(self, member: discord.Member) -> MemberStats | None:
         return self.get(member)
 
     def __contains__(self, member: discord.Member) -> bool:
-        return member in self.member_stats
+        store = self.stores.get(member.guild.id)
+        return store is not None and member.id in store
+
+    def __iter__(self) -> Iterator[MemberStats]:
+        for store in self.stores.values():
+            for id in store.ids:
+                yield MemberStats(self._bot, store, id)
 
-    def __iter__(self) -> list[MemberStats]:
-        return self.member_stats
+    def __len__(self) -> int:
+        return sum(len(store) for store in self.stores.values())
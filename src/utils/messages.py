@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import sys
+import zlib
+
+import discord
+
+from . import CacheMetrics
+
+
+@dataclass(frozen=True, slots=True)
+class CachedMessage:
+    '''What mod logging needs to know about a message after it's gone.'''
+    id: int
+    author_id: int
+    channel_id: int
+    content: str
+    image_url: str | None
+
+
+class MessageCache(CacheMetrics):
+    '''Compressed cache of message content for edit/delete logging, capped by a byte budget shared fairly between guilds.
+
+    No guild may use more than an equal share of the budget, so a busy guild can't push out every other guild's history.
+    If guilds leave room unused, the others may grow into it until the budget is hit, after which guilds give up their
+    oldest messages in turn.
+    '''
+    __slots__ = '_guilds', '_usage', 'budget', 'nbytes', 'hits', 'misses', 'evictions'
+
+    COMPRESS_MIN = 96  # Content shorter than this, in bytes, is stored as is since zlib wouldn't make it smaller
+    # Raw deflate with a 512-byte window and minimal memory level. Messages are short, so this compresses as well as the
+    # defaults at a fraction of the set-up cost per message.
+    WBITS = -9
+    MEM_LEVEL = 1
+    MIN_GUILD_BYTES = 64 * 1024  # The least each guild may keep, however many guilds share the budget
+    ENTRY_OVERHEAD = 200  # Approximate bytes per entry besides the payload: tuple, ints and dict slot
+
+    def __init__(self, budget: int = 16 * 1024 * 1024):
+        # guild_id -> message_id -> (author_id, channel_id, payload), oldest first
+        self._guilds: OrderedDict[int, OrderedDict[int, tuple[int, int, bytes]]] = OrderedDict()
+        self._usage: dict[int, int] = {}  # guild_id -> bytes
+        self.budget: int = budget
+        self.nbytes: int = 0
+
+        # Metrics
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    @classmethod
+    def _pack(cls, content: str, image_url: str | None) -> bytes:
+        data = f'{content}\0{image_url or ""}'.encode()
+        if len(data) >= cls.COMPRESS_MIN:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, cls.WBITS, cls.MEM_LEVEL)
+            return b'z' + compressor.compress(data) + compressor.flush()
+
+        return b'r' + data
+
+    @classmethod
+    def _unpack(cls, payload: bytes) -> tuple[str, str | None]:
+        data = zlib.decompress(payload[1:], cls.WBITS) if payload[:1] == b'z' else payload[1:]
+        content, _, image_url = data.decode().rpartition('\0')
+
+        return content, image_url or None
+
+    @classmethod
+    def _size(cls, payload: bytes) -> int:
+        return sys.getsizeof(payload) + cls.ENTRY_OVERHEAD
+
+    @staticmethod
+    def image_url(message: discord.Message) -> str | None:
+        if message.attachments:
+            attachment = message.attachments[0]
+            if attachment.url.lower().endswith(('png', 'jpeg', 'jpg', 'gif', 'webp')):
+                # The proxy keeps serving the image for a while after the message is deleted
+                return attachment.proxy_url
+
+        return None
+
+    def add(self, message: discord.Message):
+        self.put(message.guild.id, message.id, message.author.id, message.channel.id, message.content, self.image_url(message))
+
+    def put(self, guild_id: int, message_id: int, author_id: int, channel_id: int, content: str, image_url: str | None):
+        self.discard(guild_id, message_id)
+
+        payload = self._pack(content, image_url)
+        messages = self._guilds.get(guild_id)
+        if messages is None:
+            messages = self._guilds[guild_id] = OrderedDict()
+            self._usage[guild_id] = 0
+        messages[message_id] = author_id, channel_id, payload
+        size = self._size(payload)
+        self._usage[guild_id] += size
+        self.nbytes += size
+
+        # A guild over its share makes room itself
+        share = max(self.budget // len(self._guilds), self.MIN_GUILD_BYTES)
+        while self._usage.get(guild_id, 0) > share:
+            self._evict(guild_id)
+
+        # Otherwise guilds take turns giving up their oldest message
+        while self.nbytes > self.budget and self._guilds:
+            victim = next(iter(self._guilds))
+            self._guilds.move_to_end(victim)
+            self._evict(victim)
+
+    def _evict(self, guild_id: int):
+        messages = self._guilds[guild_id]
+        _, (_, _, payload) = messages.popitem(last=False)
+        self._release(guild_id, self._size(payload))
+        self.evictions += 1
+
+    def _release(self, guild_id: int, size: int):
+        self._usage[guild_id] -= size
+        self.nbytes -= size
+        if not self._guilds[guild_id]:
+            del self._guilds[guild_id]
+            del self._usage[guild_id]
+
+    def get(self, guild_id: int, message_id: int) -> CachedMessage | None:
+        messages = self._guilds.get(guild_id)
+        entry = messages.get(message_id) if messages is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        author_id, channel_id, payload = entry
+        content, image_url = self._unpack(payload)
+
+        return CachedMessage(message_id, author_id, channel_id, content, image_url)
+
+    def pop(self, guild_id: int, message_id: int) -> CachedMessage | None:
+        message = self.get(guild_id, message_id)
+        if message is not None:
+            self.discard(guild_id, message_id)
+
+        return message
+
+    def discard(self, guild_id: int, message_id: int):
+        messages = self._guilds.get(guild_id)
+        entry = messages.pop(message_id, None) if messages is not None else None
+        if entry is not None:
+            self._release(guild_id, self._size(entry[2]))
+
+    def discard_guild(self, guild_id: int):
+        if guild_id in self._guilds:
+            del self._guilds[guild_id]
+            self.nbytes -= self._usage.pop(guild_id)
+
+    def __len__(self) -> int:
+        return sum(len(messages) for messages in self._guilds.values())
@@ -3,20 +3,24 @@ from typing import TYPE_CHECKING
 
 import asyncio
 import datetime
+import heapq
+import io
 
+import asyncpg
 import discord
 from discord import Embed, File
 
-from . import aobject, Color
+from . import aobject, Color, Reconciliation
 
 if TYPE_CHECKING:
     from tau import Tau
 
 
 class Reminder:
-    __slots__ = 'user', 'channel', 'delta', 'time', 'text'
+    __slots__ = 'id', 'user', 'channel', 'delta', 'time', 'text'
 
     def __init__(self, user: discord.User | discord.Member, channel: discord.TextChannel, time: datetime.datetime, text: str):
+        self.id: int | None = None  # Assigned by the database
         self.user: discord.User = user
         self.channel: discord.TextChannel = channel
         self.delta: datetime.timedelta = time - discord.utils.utcnow()
@@ -33,58 +37,263 @@ class Reminder:
 
 
 class ReminderHandler(aobject):
-    __slots__ = '_bot',
+    '''Delivers reminders from a single scheduler task backed by a min-heap of due times.
 
-    async def __init__(self, bot: Tau):
+    Only reminders due within the horizon are kept in memory, later ones are paged in from the table as the window advances.
+    '''
+    __slots__ = (
+        '_bot', '_heap', '_reminders', '_wakeup', '_task', '_refill_task', '_loaded_until', 'horizon',
+        'delivered', 'messages_sent', 'last_lag', 'max_lag'
+    )
+    _assets: dict[str, bytes] = {}  # Asset path -> file contents
+
+    PAGE_SIZE = 1000
+    COALESCE_WINDOW = 2.0  # Seconds early that a reminder may be sent to share a message
+    RETRY_DELAY = 60.0  # Seconds before reminders that failed to send are tried again
+
+    async def __init__(self, bot: Tau, horizon: datetime.timedelta = datetime.timedelta(hours=1)):
         self._bot = bot
+        self._heap: list[tuple[float, int]] = []  # (due timestamp, reminder id)
+        self._reminders: dict[int, Reminder] = {}  # Pending reminders by id, cancelled ones are dropped lazily from the heap
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._refill_task: asyncio.Task | None = None
+        self._loaded_until: datetime.datetime = discord.utils.utcnow() + horizon  # Every reminder due before this is in memory
+        self.horizon: datetime.timedelta = horizon
+
+        # Metrics
+        self.delivered: int = 0
+        self.messages_sent: int = 0
+        self.last_lag: float = 0.0  # Seconds between the due time and delivery
+        self.max_lag: float = 0.0
+
         SCHEMA = 'CREATE TABLE IF NOT EXISTS reminders (user_id bigint, channel_id bigint, time timestamptz, reminder text)'
         async with self._bot.pool.acquire() as con:
             await con.execute(SCHEMA)
+            await con.execute('ALTER TABLE reminders ADD COLUMN IF NOT EXISTS id bigserial PRIMARY KEY')
+            await con.execute('CREATE INDEX IF NOT EXISTS reminders_time_idx ON reminders (time, id)')
+
+            # Handle persisting reminders that are due within the horizon
+            reconciliation = Reconciliation('reminders')
+            await self._load_window(con, None, self._loaded_until, reconciliation)
+            reconciliation.phase('load')
+
+        reconciliation.log(self._bot)
+
+        self._task = asyncio.create_task(self._run())
+        self._refill_task = asyncio.create_task(self._refill())
+
+    async def _load_window(
+        self,
+        con: asyncpg.Connection,
+        start: datetime.datetime | None,
+        end: datetime.datetime,
+        reconciliation: Reconciliation | None = None
+    ):
+        '''Schedules every reminder due in [start, end), a page at a time'''
+        columns = 'SELECT id, user_id, channel_id, time, reminder FROM reminders'
+        cursor: tuple[datetime.datetime, int] | None = None
+        while True:
+            if cursor is not None:
+                stmt = f'{columns} WHERE (time, id) > ($1, $2) AND time < $3 ORDER BY time, id LIMIT $4'
+                records = await con.fetch(stmt, *cursor, end, self.PAGE_SIZE)
+            elif start is not None:
+                stmt = f'{columns} WHERE time >= $1 AND time < $2 ORDER BY time, id LIMIT $3'
+                records = await con.fetch(stmt, start, end, self.PAGE_SIZE)
+            else:
+                stmt = f'{columns} WHERE time < $1 ORDER BY time, id LIMIT $2'
+                records = await con.fetch(stmt, end, self.PAGE_SIZE)
+
+            stale_ids: list[int] = []
+            for id, user_id, channel_id, time, text in records:
+                channel = self._bot.get_channel(channel_id)
+                member = channel.guild.get_member(user_id) if channel is not None else None
+                if member is not None:
+                    reminder = Reminder(member, channel, time, text)
+                    reminder.id = id
+                    self.schedule(reminder)
+                else:
+                    # In case the channel or user no longer exists
+                    stale_ids.append(id)
+
+            if stale_ids:
+                await con.execute('DELETE FROM reminders WHERE id = ANY($1::bigint[])', stale_ids)
+            if reconciliation is not None:
+                reconciliation.pruned += len(stale_ids)
+
+            if len(records) < self.PAGE_SIZE:
+                break
+
+            cursor = (records[-1]['time'], records[-1]['id'])
+
+    async def _refill(self):
+        '''Periodically pages in the reminders that have entered the horizon'''
+        while True:
+            await asyncio.sleep(self.horizon.total_seconds() / 2)
+
+            start = self._loaded_until
+            # Advanced before querying so that reminders added meanwhile are scheduled by add()
+            self._loaded_until = discord.utils.utcnow() + self.horizon
+            try:
+                async with self._bot.pool.acquire() as con:
+                    await self._load_window(con, start, self._loaded_until)
+            except Exception as err:
+                # Load the whole window again next time, schedule() skips the reminders that did load
+                self._loaded_until = start
+                self._bot.console.log(f'Failed to load reminders: {err}', style='red')
+
+    @property
+    def pending(self) -> int:
+        return len(self._reminders)
+
+    @property
+    def lag(self) -> float:
+        '''Seconds that the most overdue pending reminder is late by'''
+        self._prune()
+        if not self._heap:
+            return 0.0
+
+        return max(0.0, discord.utils.utcnow().timestamp() - self._heap[0][0])
+
+    def get(self, id: int) -> Reminder | None:
+        return self._reminders.get(id)
+
+    def schedule(self, reminder: Reminder):
+        if reminder.id in self._reminders:
+            return
 
-            # Handle persisting reminders
-            records = await con.fetch('SELECT * FROM reminders')
-            for user_id, channel_id, time, text in records:
-                valid = False
-                channel = self._bot.get_channel(channel_id)  # Bot.get_channel is slow, however this is just during start-up.
-                if channel:
-                    member = channel.guild.get_member(user_id)
-                    if member:
-                        reminder = Reminder(member, channel, time, text)
-                        asyncio.create_task(self.activate(reminder))
-                        valid = True
-
-                # In case the channel or user no longer exists
-                if not valid:
-                    async with self._bot.pool.acquire() as con:
-                        stmt = 'DELETE FROM reminders WHERE user_id = $1 AND channel_id = $2 AND time = $3 AND reminder = $4'
-                        await con.execute(stmt, user_id, channel_id, time, text)
-
-    async def activate(self, reminder: Reminder):
-        now = discord.utils.utcnow()
-        remainder = (reminder.time-now).total_seconds()
-        await asyncio.sleep(remainder)
-
-        files = [File('assets/dot.png', 'unknown.png'), File('assets/clock.png', 'unknown1.png')]
-        embed = (
-            Embed(description=f'>>> {reminder}', color=Color.primary)
-            .set_author(name='Reminder', icon_url='attachment://unknown.png')
-            .set_footer(text='Time\'s up!', icon_url='attachment://unknown1.png')
-        )
-        await reminder.channel.send(reminder.user.mention, embed=embed, files=files)
-
-        await self.remove(reminder)
-
-    async def add(self, reminder: Reminder):
+        self._reminders[reminder.id] = reminder
+        due = reminder.time.timestamp()
+        heapq.heappush(self._heap, (due, reminder.id))
+        if self._heap[0][1] == reminder.id:
+            # New earliest deadline
+            self._wakeup.set()
+
+    async def cancel(self, id: int) -> bool:
+        self._reminders.pop(id, None)
         async with self._bot.pool.acquire() as con:
-            stmt = 'INSERT INTO reminders VALUES ($1, $2, $3, $4)'
-            await con.execute(stmt, reminder.user.id, reminder.channel.id, reminder.time, reminder.text)
+            result = await con.execute('DELETE FROM reminders WHERE id = $1', id)
+
+        return result != 'DELETE 0'
+
+    def _prune(self):
+        while self._heap and self._heap[0][1] not in self._reminders:
+            heapq.heappop(self._heap)
+
+    async def _run(self):
+        while True:
+            self._prune()
+            if not self._heap:
+                timeout = None
+            else:
+                timeout = self._heap[0][0] - discord.utils.utcnow().timestamp()
+
+            if timeout is None or timeout > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Take everything due within the coalescing window so that reminders can share messages
+            now = discord.utils.utcnow().timestamp()
+            reminders: list[Reminder] = []
+            while self._heap and self._heap[0][0] <= now + self.COALESCE_WINDOW:
+                due, id = heapq.heappop(self._heap)
+                reminder = self._reminders.pop(id, None)
+                if reminder is not None:
+                    if not reminders:
+                        self.last_lag = max(0.0, now - due)
+                        self.max_lag = max(self.max_lag, self.last_lag)
+                    reminders.append(reminder)
+
+            try:
+                await self.deliver(reminders)
+            except Exception as err:
+                self._bot.console.log(f'Failed to deliver reminders: {err}', style='red')
+
+    async def deliver(self, reminders: list[Reminder]):
+        '''Sends due reminders grouped by channel, then deletes the handled ones in one statement'''
+        channels: dict[int, list[Reminder]] = {}
+        for reminder in reminders:
+            channels.setdefault(reminder.channel.id, []).append(reminder)
+
+        # Channels are rate limited separately, so they can be sent to concurrently
+        results = await asyncio.gather(*(self._send(channel_id, group) for channel_id, group in channels.items()), return_exceptions=True)
+        handled: set[int] = set()
+        for result in results:
+            if isinstance(result, Exception):
+                self._bot.console.log(f'Failed to deliver reminders: {result}', style='red')
+            else:
+                handled.update(result)
+
+        # Reminders that failed to send stay in the table and are tried again later
+        retry_at = discord.utils.utcnow().timestamp() + self.RETRY_DELAY
+        for reminder in reminders:
+            if reminder.id not in handled:
+                self._reminders[reminder.id] = reminder
+                heapq.heappush(self._heap, (retry_at, reminder.id))
 
-        asyncio.create_task(self.activate(reminder))
+        if handled:
+            async with self._bot.pool.acquire() as con:
+                await con.execute('DELETE FROM reminders WHERE id = ANY($1::bigint[])', list(handled))
 
-    async def remove(self, reminder: Reminder):
+    async def _send(self, channel_id: int, reminders: list[Reminder]) -> list[int]:
+        '''Returns the IDs of the reminders that were sent or can never be'''
+        # Skip reminders whose channel or user disappeared while pending
+        channel = self._bot.get_channel(channel_id)
+        if channel is None:
+            return [reminder.id for reminder in reminders]
+
+        handled = [reminder.id for reminder in reminders if channel.guild.get_member(reminder.user.id) is None]
+        reminders = [reminder for reminder in reminders if channel.guild.get_member(reminder.user.id) is not None]
+        for i in range(0, len(reminders), 10):  # A message holds at most 10 embeds
+            chunk = reminders[i:i+10]
+            mentions = ' '.join(dict.fromkeys(reminder.user.mention for reminder in chunk))
+            embeds = [
+                Embed(description=f'>>> {reminder}', color=Color.primary)
+                .set_author(name='Reminder', icon_url='attachment://unknown.png')
+                .set_footer(text='Time\'s up!', icon_url='attachment://unknown1.png')
+                for reminder in chunk
+            ]
+            files = [self._asset('assets/dot.png', 'unknown.png'), self._asset('assets/clock.png', 'unknown1.png')]
+            try:
+                await channel.send(mentions, embeds=embeds, files=files)
+            except (discord.Forbidden, discord.NotFound):
+                # The bot can't post here, trying again won't change that
+                handled += (reminder.id for reminder in reminders[i:])
+                break
+            except Exception as err:
+                self._bot.console.log(f'Failed to deliver reminders: {err}', style='red')
+                break
+
+            handled += (reminder.id for reminder in chunk)
+            self.delivered += len(chunk)
+            self.messages_sent += 1
+
+        return handled
+
+    @classmethod
+    def _asset(cls, path: str, filename: str) -> File:
+        '''Returns a File for an asset, reading it from disk only once'''
+        data = cls._assets.get(path)
+        if data is None:
+            with open(path, 'rb') as file:
+                data = cls._assets[path] = file.read()
+
+        return File(io.BytesIO(data), filename)
+
+    async def add(self, reminder: Reminder) -> int:
         async with self._bot.pool.acquire() as con:
-            stmt = 'DELETE FROM reminders WHERE user_id = $1 AND channel_id = $2 AND time = $3 AND reminder = $4'
-            await con.execute(stmt, reminder.user.id, reminder.channel.id, reminder.time, reminder.text)
+            stmt = 'INSERT INTO reminders (user_id, channel_id, time, reminder) VALUES ($1, $2, $3, $4) RETURNING id'
+            reminder.id = await con.fetchval(stmt, reminder.user.id, reminder.channel.id, reminder.time, reminder.text)
+
+        # Reminders beyond the horizon are paged in later
+        if reminder.time < self._loaded_until:
+            self.schedule(reminder)
+
+        return reminder.id
 
     async def remove_user(self, user: discord.User):
         async with self._bot.pool.acquire() as con:
@@ -1,53 +1,176 @@
 from __future__ import annotations
 from typing import List, TYPE_CHECKING
 
+import asyncio
+
 import discord
 from discord.app_commands import AppCommandError
 
-from . import aobject
+from . import aobject, Reconciliation
 
 if TYPE_CHECKING:
+    import asyncpg
+
     from tau import Tau
 
 
+class RoleSelections:
+    '''Applies role menu selections with a single member edit each.
+
+    Selections from a member while an edit for them is in flight are coalesced, so only their latest choice on each menu
+    is applied, in one follow-up edit.
+    '''
+    __slots__ = '_pending', '_running', 'edits', 'coalesced'
+
+    def __init__(self):
+        # (guild_id, member_id) -> menu message_id -> (role IDs on the menu, role IDs selected)
+        self._pending: dict[tuple[int, int], dict[int, tuple[frozenset[int], frozenset[int]]]] = {}
+        self._running: set[tuple[int, int]] = set()  # Members with an edit in flight
+
+        # Metrics
+        self.edits: int = 0
+        self.coalesced: int = 0  # Selections replaced by a later one before being applied
+
+    async def apply(self, member: discord.Member, menu_id: int, menu_role_ids: frozenset[int], selected_ids: frozenset[int]):
+        key = member.guild.id, member.id
+        pending = self._pending.setdefault(key, {})
+        if menu_id in pending:
+            self.coalesced += 1
+        pending[menu_id] = menu_role_ids, selected_ids
+
+        if key in self._running:
+            # The edit in flight picks this selection up when it's done
+            return
+
+        self._running.add(key)
+        try:
+            while key in self._pending:
+                selections = self._pending.pop(key)
+                current_ids = {role.id for role in member.roles if not role.is_default()}
+                role_ids = current_ids.copy()
+                for menu_role_ids, selected_ids in selections.values():
+                    role_ids -= menu_role_ids
+                    role_ids |= selected_ids
+
+                if role_ids != current_ids:
+                    member = await member.edit(roles=[discord.Object(id=role_id) for role_id in role_ids]) or member
+                    self.edits += 1
+        finally:
+            self._running.discard(key)
+            self._pending.pop(key, None)
+
+
 class RoleMenuHandler(aobject):
-    __slots__ = '_bot',
-    _message_ids: list[int] = []
+    '''Role menus are restored from their stored definitions, so start-up needs no message fetches.
+
+    Whether the messages still exist is checked afterwards in the background.
+    '''
+    __slots__ = '_bot', '_verify_task', 'selections'
+    _message_ids: set[int] = set()
+
+    VERIFY_CONCURRENCY = 4  # Messages fetched at once while verifying role menus
 
     async def __init__(self, bot: Tau):
         self._bot = bot
+        self.selections = RoleSelections()
         SCHEMA = (
             'CREATE TABLE IF NOT EXISTS role_menus (guild_id bigint, channel_id bigint, message_id bigint PRIMARY KEY, '
             'CONSTRAINT fk_guild FOREIGN KEY (guild_id) REFERENCES guilds(id) ON DELETE CASCADE)'
         )
+        # The select menu's definition. Menus made before these columns existed have NULL role_ids until verified.
+        DEFINITION_SCHEMA = (
+            'ALTER TABLE role_menus ADD COLUMN IF NOT EXISTS placeholder text, '
+            'ADD COLUMN IF NOT EXISTS max_values smallint DEFAULT 25, ADD COLUMN IF NOT EXISTS role_ids bigint[], '
+            'ADD COLUMN IF NOT EXISTS labels text[], ADD COLUMN IF NOT EXISTS descriptions text[], ADD COLUMN IF NOT EXISTS emoji text[]'
+        )
         async with self._bot.pool.acquire() as con:
             await con.execute(SCHEMA)
+            await con.execute(DEFINITION_SCHEMA)
 
+            reconciliation = Reconciliation('role_menus')
             records = await con.fetch('SELECT * FROM role_menus')
-            for guild_id, channel_id, message_id in records:
+            reconciliation.phase('fetch')
+
+            stale_ids: list[int] = []
+            unverified: list[tuple[discord.TextChannel, int, bool]] = []  # (channel, message_id, has definition)
+            for record in records:
+                message_id = record['message_id']
+                guild = self._bot.get_guild(record['guild_id'])
+                channel = guild.get_channel(record['channel_id']) if guild is not None else None
+                if channel is None:
+                    stale_ids.append(message_id)
+                    continue
+
+                self._message_ids.add(message_id)
+                has_definition = record['role_ids'] is not None
+                if has_definition:
+                    role_select = RoleMenuSelect.from_record(record)
+                    self._bot.add_view(RoleMenuView(role_select=role_select), message_id=message_id)
+                unverified.append((channel, message_id, has_definition))
+            reconciliation.phase('register')
+
+            if stale_ids:
+                await con.execute('DELETE FROM role_menus WHERE message_id = ANY($1::bigint[])', stale_ids)
+            reconciliation.pruned = len(stale_ids)
+            reconciliation.phase('apply')
+
+        reconciliation.log(self._bot)
+        self._verify_task: asyncio.Task = asyncio.create_task(self._verify(unverified))
+
+    async def _verify(self, unverified: list[tuple[discord.TextChannel, int, bool]]):
+        '''Removes role menus whose message no longer exists and stores the definition of menus made before it was stored'''
+        semaphore = asyncio.Semaphore(self.VERIFY_CONCURRENCY)
+
+        async def verify(channel: discord.TextChannel, message_id: int, has_definition: bool) -> int | None:
+            async with semaphore:
                 try:
-                    guild = self._bot.get_guild(guild_id)
-                    channel = guild.get_channel(channel_id)
                     message = await channel.fetch_message(message_id)
+                except discord.NotFound:
+                    return message_id
+                except discord.HTTPException:
+                    # Might be temporary, so keep the menu
+                    return None
+
+            if not has_definition:
+                view = RoleMenuView.from_message(message)
+                if view is None:
+                    return message_id
+
+                self._bot.add_view(view, message_id=message_id)
+                await self.update(view, message)
+
+            return None
+
+        results = await asyncio.gather(*(verify(*menu) for menu in unverified))
+        stale_ids = [message_id for message_id in results if message_id is not None]
+        if stale_ids:
+            self._message_ids.difference_update(stale_ids)
+            async with self._bot.pool.acquire() as con:
+                await con.execute('DELETE FROM role_menus WHERE message_id = ANY($1::bigint[])', stale_ids)
 
-                    view = RoleMenuView.from_message(message)
-                    if view is not None:
-                        self._message_ids.append(message.id)
-                        self._bot.add_view(view, message_id=message.id)
-                except (AttributeError, discord.NotFound):
-                    await self.remove(message)
+        self._bot.console.log(f'Verified {len(unverified)} role menus: {len(stale_ids)} pruned')
 
     async def add(self, view: RoleMenuView, message: discord.Message):
-        self._message_ids.append(message.id)
+        self._message_ids.add(message.id)
         self._bot.add_view(view, message_id=message.id)
         async with self._bot.pool.acquire() as con:
-            await con.execute('INSERT INTO role_menus VALUES ($1, $2, $3)', message.guild.id, message.channel.id, message.id)
+            await con.execute(
+                'INSERT INTO role_menus (guild_id, channel_id, message_id, placeholder, max_values, role_ids, labels, descriptions, emoji) '
+                'VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)',
+                message.guild.id, message.channel.id, message.id, *view.role_select.to_record()
+            )
+
+    async def update(self, view: RoleMenuView, message: discord.Message):
+        '''Stores the current definition of a role menu, called whenever its select menu changes'''
+        async with self._bot.pool.acquire() as con:
+            await con.execute(
+                'UPDATE role_menus SET placeholder = $2, max_values = $3, role_ids = $4, labels = $5, descriptions = $6, '
+                'emoji = $7 WHERE message_id = $1',
+                message.id, *view.role_select.to_record()
+            )
 
     async def remove(self, message: discord.Message):
-        try:
-            self._message_ids.remove(message.id)
-        except ValueError:  # Ignore if message.id is not present
-            pass
+        self._message_ids.discard(message.id)
 
         async with self._bot.pool.acquire() as con:
             await con.execute('DELETE FROM role_menus WHERE message_id = $1', message.id)
@@ -56,6 +179,9 @@ class RoleMenuHandler(aobject):
     def message_ids(self) -> tuple[int]:
         return tuple(self._message_ids)
 
+    def __contains__(self, message: discord.Message | discord.Object) -> bool:
+        return message.id in self._message_ids
+
 
 # An option to represent no role
 class NoneSelectOption(discord.SelectOption):
@@ -73,25 +199,24 @@ class NoneSelectOption(discord.SelectOption):
 
 
 class RoleMenuSelect(discord.ui.Select):
-    def __init__(self, *, placeholder: str | None = None, max_values: int = 25, options: List[discord.SelectOption] = [NoneSelectOption()]):
+    def __init__(self, *, placeholder: str | None = None, max_values: int = 25, options: List[discord.SelectOption] | None = None):
         self._max_values = max_values
+        options = options if options is not None else [NoneSelectOption()]
         super().__init__(custom_id='persistent::role_menu', placeholder=placeholder, options=options)
 
         self._underlying.disabled = self.disabled
 
     async def callback(self, interaction: discord.Interaction):
-        # Called when a user changes their choices
-        member = interaction.user
-        role_options = self.options.copy()[1:]
-        roles = [interaction.guild.get_role(int(option.value)) for option in role_options]
-        for role, option in zip(roles, role_options):
-            if option.value in self.values and role not in member.roles:
-                await member.add_roles(role)
-            elif option.value not in self.values and role in member.roles:
-                await member.remove_roles(role)
-
+        # Called when a user changes their choices. Defer first, as the edit may have to wait for an earlier one.
         await interaction.response.defer()
 
+        guild = interaction.guild
+        menu_role_ids = frozenset(int(option.value) for option in self.options[1:])
+        selected_ids = frozenset(
+            int(value) for value in self.values if value != '[none]' and guild.get_role(int(value)) is not None
+        )
+        await interaction.client.role_menus.selections.apply(interaction.user, interaction.message.id, menu_role_ids, selected_ids)
+
     def add_option(self, *, label: str, value: str, description: str | None = None, emoji: str | discord.Emoji | discord.PartialEmoji | None = None):
         super().add_option(label=label, value=value, description=description, emoji=emoji)
         self._underlying.disabled = self.disabled
@@ -124,6 +249,26 @@ class RoleMenuSelect(discord.ui.Select):
     def from_select(cls, select: discord.ui.Select) -> RoleMenuSelect:
         return cls(placeholder=select.placeholder, max_values=select.max_values, options=select.options)
 
+    def to_record(self) -> tuple[str | None, int, list[int], list[str], list[str | None], list[str | None]]:
+        '''Returns placeholder, max_values, role_ids, labels, descriptions and emoji as stored in role_menus'''
+        role_options = self.options[1:]
+        return (
+            self.placeholder,
+            self._max_values,
+            [int(option.value) for option in role_options],
+            [option.label for option in role_options],
+            [option.description for option in role_options],
+            [str(option.emoji) if option.emoji is not None else None for option in role_options]
+        )
+
+    @classmethod
+    def from_record(cls, record: asyncpg.Record) -> RoleMenuSelect:
+        options = [NoneSelectOption()]
+        for role_id, label, description, emoji in zip(record['role_ids'], record['labels'], record['descriptions'], record['emoji']):
+            options.append(discord.SelectOption(label=label, value=str(role_id), description=description, emoji=emoji))
+
+        return cls(placeholder=record['placeholder'], max_values=record['max_values'], options=options)
+
 
 class RoleMenuView(discord.ui.View):
     __slots__ = 'role_select',
@@ -136,7 +281,7 @@ class RoleMenuView(discord.ui.View):
     @classmethod
     def from_message(cls, message: discord.Message) -> RoleMenuView | None:
         view = super().from_message(message, timeout=None)
-        if len(view.childen) != 1 or view.children[0].custom_id != 'persistent::role_menu':
+        if len(view.children) != 1 or view.children[0].custom_id != 'persistent::role_menu':
             return None
 
         role_select = RoleMenuSelect.from_select(view.children[0])
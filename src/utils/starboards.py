@@ -1,10 +1,14 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+import asyncio
+import time
 
 import discord
 from discord import Embed
+from discord.utils import MISSING
 
-from . import aobject, Color
+from . import aobject, Color, LRU, SingleFlight
 
 if TYPE_CHECKING:
     from tau import Tau
@@ -16,8 +20,9 @@ class Starboard:
     def __init__(self, bot: Tau, guild: discord.Guild):
         self._bot: Tau = bot
         self._guild: discord.Guild = guild
-        self._id: int = self._bot.guild_confs(guild).starboard_channel_id
-        self._threshold: int = self._bot.guild_confs(guild).starboard_threshold
+        snapshot = self._bot.guild_confs(guild).snapshot
+        self._id: int = snapshot.starboard_channel_id
+        self._threshold: int = snapshot.starboard_threshold
         self._channel: discord.TextChannel | None = self.guild.get_channel(self.id)
 
     @property
@@ -77,11 +82,140 @@ class Starboard:
         return embed
 
 
+class StarCounter(LRU[int, int]):
+    '''Bounded LRU of star counts per message, seeded from a fetch and kept current from raw reaction events.'''
+    __slots__ = ()
+
+    def __init__(self, capacity: int = 10000):
+        super().__init__(capacity)  # message_id -> stars
+
+    def seed(self, message_id: int, stars: int):
+        self.put(message_id, stars)
+
+    def add(self, message_id: int, delta: int) -> int | None:
+        '''Adjusts a cached count, returning the new count or None if the message is not cached'''
+        stars = self.get(message_id, None)
+        if stars is not None:
+            stars = max(0, stars + delta)
+            self._entries[message_id] = stars
+
+        return stars
+
+    def clear(self, message_id: int):
+        if message_id in self._entries:
+            self._entries[message_id] = 0
+
+
+class StarboardMessages(LRU[int, discord.PartialMessage | None]):
+    '''Bounded LRU mapping source message IDs to their starboard message, or None if they have no starboard message.
+
+    The negative entries mean repeat reactions on posts below the threshold don't need a DB query either.
+    '''
+    __slots__ = ()
+
+    def __init__(self, capacity: int = 5000):
+        super().__init__(capacity)  # message_id -> starboard message
+
+    def put(self, message_id: int, starboard_message: discord.Message | discord.PartialMessage | None):
+        if starboard_message is not None:
+            # Only the IDs are needed to edit the message later
+            starboard_message = starboard_message.channel.get_partial_message(starboard_message.id)
+
+        super().put(message_id, starboard_message)
+
+    def forget(self, starboard_message_id: int):
+        '''Turns the entries pointing at a deleted starboard message into negative entries'''
+        for message_id, starboard_message in self._entries.items():
+            if starboard_message is not None and starboard_message.id == starboard_message_id:
+                self._entries[message_id] = None
+
+    def discard_guild(self, guild_id: int):
+        '''Drops the starboard messages of a guild, e.g. after its starboard channel changed'''
+        stale_ids = [
+            message_id for message_id, starboard_message in self._entries.items()
+            if starboard_message is not None and starboard_message.guild.id == guild_id
+        ]
+        for message_id in stale_ids:
+            del self._entries[message_id]
+
+
+class StarboardEditor:
+    '''Debounces starboard message edits so that a burst of stars results in a single edit with the latest count.
+
+    Edits are also paced per guild so that busy starboards don't starve each other of the rate limit.
+    '''
+    __slots__ = '_pending', '_next_slot', '_tasks', 'window', 'interval', 'on_missing', 'edits', 'edits_saved', 'last_latency', 'total_latency'
+
+    def __init__(self, window: float = 2.0, interval: float = 1.0, on_missing: Callable[[int], Awaitable[None]] | None = None):
+        self._pending: dict[int, list] = {}  # starboard message_id -> [message, content, time queued]
+        self._next_slot: dict[int, float] = {}  # guild_id -> earliest time of the next edit, one float per guild
+        self._tasks: set[asyncio.Task] = set()  # Strong references, the event loop only keeps weak ones
+        self.window: float = window
+        self.interval: float = interval
+        self.on_missing: Callable[[int], Awaitable[None]] | None = on_missing  # Called with the ID of a deleted starboard message
+
+        # Metrics
+        self.edits: int = 0
+        self.edits_saved: int = 0
+        self.last_latency: float = 0.0  # Seconds from the first queued update to the applied edit
+        self.total_latency: float = 0.0
+
+    def schedule(self, message: discord.Message | discord.PartialMessage, content: str):
+        pending = self._pending.get(message.id)
+        if pending is not None:
+            # Replace the content of the edit that's already waiting
+            pending[1] = content
+            self.edits_saved += 1
+            return
+
+        self._pending[message.id] = [message, content, time.monotonic()]
+        task = asyncio.create_task(self._apply(message.id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _apply(self, message_id: int):
+        await asyncio.sleep(self.window)
+
+        guild_id = self._pending[message_id][0].guild.id
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(guild_id, now))
+        self._next_slot[guild_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+        # Updates arriving after this point queue a new edit
+        message, content, queued = self._pending.pop(message_id)
+        try:
+            await message.edit(content=content)
+        except discord.NotFound:
+            if self.on_missing is not None:
+                await self.on_missing(message_id)
+        except discord.HTTPException:
+            pass
+
+        self.edits += 1
+        self.last_latency = time.monotonic() - queued
+        self.total_latency += self.last_latency
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def average_latency(self) -> float:
+        return self.total_latency / self.edits if self.edits else 0.0
+
+
 class StarboardHandler(aobject):
-    __slots__ = '_bot',
+    __slots__ = '_bot', '_starboards', 'stars', 'messages', 'editor', 'flights'
 
     async def __init__(self, bot: Tau):
         self._bot = bot
+        self._starboards: dict[int, Starboard] = {}  # guild_id -> Starboard
+        self.stars = StarCounter()
+        self.messages = StarboardMessages()
+        self.editor = StarboardEditor(on_missing=self._forget)
+        self.flights = SingleFlight()  # Keyed by source message ID
         SCHEMA = (
             'CREATE TABLE IF NOT EXISTS starboard (message_id bigint PRIMARY KEY, starboard_message_id bigint, guild_id bigint, '
             'CONSTRAINT fk_guild FOREIGN KEY (guild_id) REFERENCES guilds(id) ON DELETE CASCADE)'
@@ -89,15 +223,70 @@ class StarboardHandler(aobject):
         async with self._bot.pool.acquire() as con:
             await con.execute(SCHEMA)
 
+    def get(self, guild: discord.Guild) -> Starboard:
+        starboard = self._starboards.get(guild.id)
+        if starboard is None:
+            starboard = Starboard(self._bot, guild)
+            self._starboards[guild.id] = starboard
+
+        return starboard
+
+    def invalidate(self, guild_id: int):
+        '''Drops the cached starboard of a guild, called when its starboard config changes'''
+        self._starboards.pop(guild_id, None)
+        self.messages.discard_guild(guild_id)
+
+    def __call__(self, guild: discord.Guild) -> Starboard:
+        return self.get(guild)
+
+    async def _forget(self, starboard_message_id: int):
+        self.messages.forget(starboard_message_id)
+        async with self._bot.pool.acquire() as con:
+            await con.execute('DELETE FROM starboard WHERE starboard_message_id = $1', starboard_message_id)
+
     async def add(self, message: discord.Message, starboard_message: discord.Message):
+        self.messages.put(message.id, starboard_message)
         async with self._bot.pool.acquire() as con:
             await con.execute('INSERT INTO starboard VALUES ($1, $2, $3)', message.id, starboard_message.id, message.guild.id)
 
-    async def remove(self, message: discord.Message):
+    async def remove(self, message: discord.Message | discord.Object):
+        self.messages.put(message.id, None)
         async with self._bot.pool.acquire() as con:
             await con.execute('DELETE FROM starboard WHERE message_id = $1', message.id)
 
-    async def fetch(self, message: discord.Message, starboard: Starboard) -> discord.Message | None:
+    async def post(
+        self,
+        starboard: Starboard,
+        channel: discord.TextChannel,
+        message_id: int,
+        message: discord.Message | None,
+        stars: int
+    ) -> tuple[discord.Message | discord.PartialMessage | None, int | None]:
+        '''Returns the starboard message for a message, posting it if there isn't one yet, and the star count it was posted with
+
+        Run through self.flights so that concurrent reactions on the same message share one post.
+        '''
+        starboard_message = await self.fetch(discord.Object(id=message_id), starboard)
+        if starboard_message is not None:
+            return starboard_message, None
+
+        # The full message is only needed to build the embed
+        if message is None:
+            try:
+                message = await channel.fetch_message(message_id)
+            except (discord.NotFound, discord.Forbidden):
+                return None, None
+
+        starboard_message = await starboard.channel.send(f'{starboard.star_emoji(stars)} **{stars}**', embed=starboard.embed(message))
+        await self.add(message, starboard_message)
+
+        return starboard_message, stars
+
+    async def fetch(self, message: discord.Message | discord.Object, starboard: Starboard) -> discord.Message | discord.PartialMessage | None:
+        starboard_message = self.messages.get(message.id)
+        if starboard_message is not MISSING:
+            return starboard_message
+
         starboard_message = None
         async with self._bot.pool.acquire() as con:
             record = await con.fetchrow('SELECT starboard_message_id FROM starboard WHERE message_id = $1', message.id)
@@ -106,6 +295,11 @@ class StarboardHandler(aobject):
                 try:
                     starboard_message = await starboard.channel.fetch_message(starboard_message_id)
                 except (discord.NotFound, discord.Forbidden):
-                    pass
+                    # The starboard message is gone, so forget about it
+                    await con.execute('DELETE FROM starboard WHERE message_id = $1', message.id)
 
-            return starboard_message
+        # A post made while this was awaiting is more current than this lookup
+        if message.id not in self.messages:
+            self.messages.put(message.id, starboard_message)
+
+        return starboard_message
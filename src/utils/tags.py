@@ -1,13 +1,18 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import Iterator, TYPE_CHECKING
 
+import asyncio
+from array import array
+from bisect import bisect_left, bisect_right, insort
 from dataclasses import dataclass
+import heapq
+from itertools import accumulate, islice
+import json
 
 import discord
 from discord import Embed
-from discord.utils import find
 
-from . import aobject
+from . import aobject, LRU, SingleFlight
 
 if TYPE_CHECKING:
     from tau import Tau
@@ -17,54 +22,256 @@ if TYPE_CHECKING:
 class Tag:
     guild_id: int
     name: str
-    embed: Embed = Embed()
+    embed: Embed | None = None
     content: str = ''
 
-    def __iter__(self) -> list[int | str | Embed]:
-        attr: list[str] = []
+    def __iter__(self) -> Iterator[int | str | Embed | None]:
         for anno in self.__annotations__:
-            attr.append(getattr(self, anno))
-
-        return attr
+            yield getattr(self, anno)
 
     def __eq__(self, other: Tag) -> bool:
         return self.guild_id == other.guild_id and self.name == other.name
 
 
+class TagIndex:
+    '''The tag names of a guild, indexed for autocomplete.
+
+    Names are kept sorted for prefix matching and also ranked by usage, so that broad prefixes only have to scan the
+    most used names. Substring matches are found in one string of all names, which is rebuilt after names change.
+    '''
+    __slots__ = '_names', '_ranked', '_uses', '_haystack', '_offsets'
+
+    MAX_RESULTS = 25  # Discord's limit on autocomplete choices
+    SCAN_THRESHOLD = 1000  # Prefix matches above which scanning the ranked names is cheaper than ranking the matches
+
+    def __init__(self):
+        self._names: list[str] = []  # Sorted by name
+        self._ranked: list[str] = []  # Sorted by uses, most used first
+        self._uses: dict[str, int] = {}  # name -> times used
+        self._haystack: str | None = None  # Every name in self._names, each followed by a null character
+        self._offsets: array[int] = array('q')  # Index of each name in self._haystack
+
+    @classmethod
+    def from_uses(cls, uses: dict[str, int]) -> TagIndex:
+        '''Builds an index from a mapping of names to their uses, sorting once instead of inserting one name at a time'''
+        index = cls()
+        index._uses = uses
+        index._names = sorted(uses)
+        index._ranked = sorted(uses, key=index._rank)
+
+        return index
+
+    def _rank(self, name: str) -> tuple[int, str]:
+        return -self._uses[name], name
+
+    def add(self, name: str, uses: int = 0):
+        if name in self._uses:
+            self.remove(name)
+
+        insort(self._names, name)
+        self._uses[name] = uses
+        insort(self._ranked, name, key=self._rank)
+        self._haystack = None
+
+    def remove(self, name: str):
+        if name not in self._uses:
+            return
+
+        del self._names[bisect_left(self._names, name)]
+        del self._ranked[bisect_left(self._ranked, self._rank(name), key=self._rank)]
+        del self._uses[name]
+        self._haystack = None
+
+    def use(self, name: str):
+        if name not in self._uses:
+            return
+
+        ranked = self._ranked
+        del ranked[bisect_left(ranked, self._rank(name), key=self._rank)]
+        self._uses[name] += 1
+        insort(ranked, name, key=self._rank)
+
+    def uses(self, name: str) -> int:
+        return self._uses.get(name, 0)
+
+    def top(self, count: int) -> list[str]:
+        '''Returns the most used names'''
+        return self._ranked[:count]
+
+    def search(self, text: str, limit: int = MAX_RESULTS, substring: bool = True) -> list[str]:
+        '''Returns the most used names starting with text, followed by the most used names containing it if there's room'''
+        names = self._names
+        # Every name starting with text sorts between text and text followed by the highest code point
+        start = bisect_left(names, text)
+        end = bisect_left(names, text + '\U0010ffff', start)
+        if end - start > self.SCAN_THRESHOLD:
+            # So many names match that the most used ones are found early in the ranked names
+            results = list(islice((name for name in self._ranked if name.startswith(text)), limit))
+        else:
+            results = heapq.nlargest(limit, names[start:end], key=self._uses.__getitem__)
+
+        if substring and text and len(results) < limit:
+            contained = (name for name in self._containing(text) if not name.startswith(text))
+            results += heapq.nlargest(limit - len(results), contained, key=self._uses.__getitem__)
+
+        return results
+
+    def _containing(self, text: str) -> Iterator[str]:
+        if self._haystack is None:
+            self._haystack = '\0'.join(self._names) + '\0'
+            self._offsets = array('q', accumulate((len(name) + 1 for name in self._names[:-1]), initial=0))
+
+        haystack, offsets, names = self._haystack, self._offsets, self._names
+        i = haystack.find(text)
+        while i != -1:
+            n = bisect_right(offsets, i) - 1
+            yield names[n]
+            # Skip to the next name so that each name is only yielded once
+            i = haystack.find(text, offsets[n+1]) if n + 1 < len(offsets) else -1
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._uses
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+class TagCache(LRU[tuple[int, str], Tag]):
+    '''Bounded LRU of tags with their embed already parsed, ready to send.'''
+    __slots__ = ()
+
+    def __init__(self, capacity: int = 2000):
+        super().__init__(capacity)  # (guild_id, name) -> Tag
+
+    def get(self, guild_id: int, name: str) -> Tag | None:
+        return super().get((guild_id, name), None)
+
+    def put(self, tag: Tag):
+        super().put((tag.guild_id, tag.name), tag)
+
+    def discard(self, guild_id: int, name: str):
+        super().discard((guild_id, name))
+
+
 class TagHandler(aobject):
-    __slots__ = '_bot',
-    tags: list[Tag] = []
+    '''Only tag names and their uses are kept in memory. Bodies are loaded on demand through a bounded cache.'''
+    __slots__ = '_bot', 'cache', '_flights', '_prefetched', '_tasks'
+    indexes: dict[int, TagIndex] = {}  # guild_id -> TagIndex
+
+    PREFETCH_COUNT = 20  # Most used tags loaded in one query the first time a guild looks up tags
 
     async def __init__(self, bot: Tau):
         self._bot = bot
+        self.cache = TagCache()
+        self._flights = SingleFlight()  # Keyed by (guild_id, name)
+        self._prefetched: set[int] = set()  # IDs of guilds whose most used tags have been prefetched
+        self._tasks: set[asyncio.Task] = set()  # Strong references, the event loop only keeps weak ones
         SCHEMA = (
             'CREATE TABLE IF NOT EXISTS tags (guild_id bigint, name text, embed text, content text, '
             'CONSTRAINT fk_guild FOREIGN KEY (guild_id) REFERENCES guilds(id) ON DELETE CASCADE)'
         )
         async with self._bot.pool.acquire() as con:
             await con.execute(SCHEMA)
+            await con.execute('ALTER TABLE tags ADD COLUMN IF NOT EXISTS uses integer DEFAULT 0')
+            await con.execute('CREATE INDEX IF NOT EXISTS tags_guild_name_idx ON tags (guild_id, name)')
+
+            uses: dict[int, dict[str, int]] = {}  # guild_id -> name -> times used
+            for guild_id, name, tag_uses in await con.fetch('SELECT guild_id, name, uses FROM tags'):
+                uses.setdefault(guild_id, {})[name] = tag_uses or 0
 
-            records = await con.fetch('SELECT * FROM tags')
-            for guild_id, name, embed, content in records:
-                tag = Tag(guild_id, name, Embed.from_json(embed), content)
-                self.tags.append(tag)
+            for guild_id, guild_uses in uses.items():
+                self.indexes[guild_id] = TagIndex.from_uses(guild_uses)
+
+    @staticmethod
+    def _tag(guild_id: int, name: str, embed: str | None, content: str | None) -> Tag:
+        return Tag(guild_id, name, Embed.from_dict(json.loads(embed)) if embed else None, content or '')
+
+    def index(self, guild_id: int) -> TagIndex:
+        index = self.indexes.get(guild_id)
+        if index is None:
+            index = self.indexes[guild_id] = TagIndex()
+
+        return index
 
     async def add(self, tag: Tag):
-        self.tags.append(Tag)
+        self.cache.put(tag)
+        self.index(tag.guild_id).add(tag.name)
+        embed = json.dumps(tag.embed.to_dict()) if tag.embed is not None else None
         async with self._bot.pool.acquire() as con:
-            await con.execute('INSERT INTO tags VALUES ($1, $2, $3, $4)', *tag)
+            await con.execute('INSERT INTO tags VALUES ($1, $2, $3, $4)', tag.guild_id, tag.name, embed, tag.content)
 
     async def remove(self, guild: discord.Guild, tag_name: str):
-        self.tags.remove(Tag(guild.id, tag_name))
+        self.cache.discard(guild.id, tag_name)
+        self.index(guild.id).remove(tag_name)
         async with self._bot.pool.acquire() as con:
             await con.execute('DELETE FROM tags WHERE guild_id = $1 AND name = $2', guild.id, tag_name)
 
     async def get(self, guild: discord.Guild, tag_name: str) -> Tag | None:
-        return find(lambda tag: tag.guild_id == guild.id and tag.name == tag_name, self.tags)
+        index = self.indexes.get(guild.id)
+        if index is None or tag_name not in index:
+            return None
+
+        tag = self.cache.get(guild.id, tag_name)
+        if tag is None:
+            self.prefetch(guild)
+            tag = await self._flights((guild.id, tag_name), self._load, guild.id, tag_name)
+
+        return tag
+
+    async def _load(self, guild_id: int, tag_name: str) -> Tag | None:
+        async with self._bot.pool.acquire() as con:
+            record = await con.fetchrow('SELECT embed, content FROM tags WHERE guild_id = $1 AND name = $2', guild_id, tag_name)
+
+        if record is None or tag_name not in self.index(guild_id):
+            # Deleted while loading
+            return None
+
+        tag = self._tag(guild_id, tag_name, record['embed'], record['content'])
+        self.cache.put(tag)
+
+        return tag
+
+    def prefetch(self, guild: discord.Guild):
+        '''Loads the most used tags of a guild in the background, once per guild'''
+        if guild.id not in self._prefetched and guild.id in self.indexes:
+            self._prefetched.add(guild.id)
+            task = asyncio.create_task(self._prefetch(guild.id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch(self, guild_id: int):
+        names = [name for name in self.index(guild_id).top(self.PREFETCH_COUNT) if (guild_id, name) not in self.cache]
+        if not names:
+            return
+
+        async with self._bot.pool.acquire() as con:
+            records = await con.fetch(
+                'SELECT name, embed, content FROM tags WHERE guild_id = $1 AND name = ANY($2::text[])', guild_id, names
+            )
+
+        index = self.index(guild_id)
+        for name, embed, content in records:
+            if name in index and (guild_id, name) not in self.cache:
+                self.cache.put(self._tag(guild_id, name, embed, content))
+
+    async def use(self, tag: Tag):
+        '''Counts a use of a tag, which ranks it higher in search results'''
+        self.index(tag.guild_id).use(tag.name)
+        async with self._bot.pool.acquire() as con:
+            await con.execute('UPDATE tags SET uses = uses + 1 WHERE guild_id = $1 AND name = $2', tag.guild_id, tag.name)
+
+    def search(self, guild: discord.Guild, text: str) -> list[str]:
+        index = self.indexes.get(guild.id)
+        if index is None:
+            return []
+
+        # Someone is about to get a tag, so warm the cache while they type
+        self.prefetch(guild)
 
-    def search(self, guild: discord.Guild, text: str) -> list[Tag]:
-        tags = filter(lambda tag: tag.guild_id == guild.id and text in tag.name, self.tags)
-        return tags if len(tags) <= 25 else tags[:25]
+        return index.search(text)
 
     def __call__(self, guild: discord.Guild, tag_name: str) -> Tag | None:
         return self.get(guild, tag_name)
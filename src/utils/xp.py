@@ -1,9 +1,11 @@
 from __future__ import annotations
-from typing import Any, TYPE_CHECKING
+from typing import Any, Iterable, Iterator, TYPE_CHECKING
 
-import heapq
+from bisect import bisect_left, bisect_right, insort
 from dataclasses import dataclass
-from math import sqrt
+from math import isqrt
+import sys
+import time
 
 import discord
 
@@ -19,7 +21,17 @@ class XP:
 
     @property
     def levels(self) -> int:
-        return int(sqrt(self.points + 121/4) - 11/2)
+        return XP.level_of(self.points)
+
+    @staticmethod
+    def level_of(points: int) -> int:
+        # Largest n where n^2 + 11n <= points, solved exactly in integers
+        return (isqrt(4 * points + 121) - 11) // 2 if points > 0 else 0
+
+    @staticmethod
+    def levels_of(points: Iterable[int]) -> list[int]:
+        '''Converts many point totals to levels in one call'''
+        return list(map(XP.level_of, points))
 
     @staticmethod
     def level_diff(u: int, v: int) -> int:
@@ -42,6 +54,249 @@ class XP:
 class Score:
     member: discord.Member
     xp: XP
+    position: int  # One-based position on the leaderboard
+
+
+class Leaderboard:
+    '''Members of a single guild ordered by XP.
+
+    Entries are kept in sorted buckets with a Fenwick tree over the bucket sizes,
+    so inserts, removals, rank queries and page offsets are all logarithmic in the number of buckets.
+    '''
+    __slots__ = '_buckets', '_maxes', '_tree', '_len'
+
+    LOAD = 512  # Target bucket size, buckets are split at twice this
+
+    def __init__(self, entries: Iterable[tuple[int, int]] = ()):
+        keys = sorted(self._key(member_id, points) for member_id, points in entries)
+        self._buckets: list[list[int]] = [keys[i:i+self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self._maxes: list[int] = [bucket[-1] for bucket in self._buckets]
+        self._tree: list[int] | None = None
+        self._len: int = len(keys)
+
+    # Highest XP first, ties broken by member ID. Packed into a single int to keep entries small.
+    @staticmethod
+    def _key(member_id: int, points: int) -> int:
+        return (-points << 64) | member_id
+
+    @staticmethod
+    def _unpack(key: int) -> tuple[int, int]:
+        return key & 0xFFFFFFFFFFFFFFFF, -(key >> 64)
+
+    def add(self, member_id: int, points: int):
+        key = self._key(member_id, points)
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._tree = None
+            self._len = 1
+            return
+
+        i = bisect_left(self._maxes, key)
+        if i == len(self._buckets):
+            i -= 1
+            self._buckets[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._buckets[i], key)
+
+        self._len += 1
+        bucket = self._buckets[i]
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets[i:i+1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self._maxes[i:i+1] = [bucket[self.LOAD-1], bucket[-1]]
+            self._tree = None
+        else:
+            self._tree_add(i, 1)
+
+    def remove(self, member_id: int, points: int):
+        key = self._key(member_id, points)
+        i = bisect_left(self._maxes, key)
+        if i == len(self._buckets):
+            return
+
+        bucket = self._buckets[i]
+        j = bisect_left(bucket, key)
+        if j == len(bucket) or bucket[j] != key:
+            return
+
+        del bucket[j]
+        self._len -= 1
+        if not bucket:
+            del self._buckets[i]
+            del self._maxes[i]
+            self._tree = None
+        else:
+            self._maxes[i] = bucket[-1]
+            self._tree_add(i, -1)
+
+    def update(self, member_id: int, old_points: int, new_points: int):
+        if old_points != new_points:
+            self.remove(member_id, old_points)
+            self.add(member_id, new_points)
+
+    def rank(self, member_id: int, points: int) -> int | None:
+        '''Returns the zero-based position of a member, or None if they are not on the leaderboard'''
+        key = self._key(member_id, points)
+        i = bisect_left(self._maxes, key)
+        if i == len(self._buckets):
+            return None
+
+        bucket = self._buckets[i]
+        j = bisect_left(bucket, key)
+        if j == len(bucket) or bucket[j] != key:
+            return None
+
+        return self._prefix(i) + j
+
+    def page(self, offset: int, count: int) -> list[tuple[int, int]]:
+        '''Returns up to count (member_id, points) pairs starting at position offset'''
+        if offset < 0 or offset >= self._len:
+            return []
+
+        i, j = self._locate(offset)
+        entries: list[tuple[int, int]] = []
+        while i < len(self._buckets) and len(entries) < count:
+            for key in self._buckets[i][j:j+count-len(entries)]:
+                entries.append(self._unpack(key))
+            i, j = i + 1, 0
+
+        return entries
+
+    @property
+    def nbytes(self) -> int:
+        '''Bytes held by the buckets and their keys, which are boxed ints of around 36 bytes each'''
+        size = sys.getsizeof(self._buckets) + sys.getsizeof(self._maxes)
+        if self._tree is not None:
+            size += sys.getsizeof(self._tree)
+        for bucket in self._buckets:
+            size += sys.getsizeof(bucket) + sum(map(sys.getsizeof, bucket))
+
+        return size
+
+    def _build_tree(self) -> list[int]:
+        tree = [len(bucket) for bucket in self._buckets]
+        for i in range(len(tree)):
+            j = i | (i + 1)
+            if j < len(tree):
+                tree[j] += tree[i]
+
+        self._tree = tree
+        return tree
+
+    def _tree_add(self, i: int, delta: int):
+        if self._tree is not None:
+            while i < len(self._tree):
+                self._tree[i] += delta
+                i |= i + 1
+
+    def _prefix(self, i: int) -> int:
+        '''Number of entries in the buckets before bucket i'''
+        tree = self._tree if self._tree is not None else self._build_tree()
+        total = 0
+        while i > 0:
+            total += tree[i-1]
+            i &= i - 1
+
+        return total
+
+    def _locate(self, offset: int) -> tuple[int, int]:
+        '''Converts a position into a (bucket, index) pair'''
+        tree = self._tree if self._tree is not None else self._build_tree()
+        i = 0
+        bit = 1 << (len(tree).bit_length() - 1)
+        while bit:
+            j = i + bit
+            if j <= len(tree) and tree[j-1] <= offset:
+                offset -= tree[j-1]
+                i = j
+            bit >>= 1
+
+        return i, offset
+
+    def __len__(self) -> int:
+        return self._len
+
+
+class XPCooldown:
+    '''Fixed-window rate limiter for message XP.
+
+    Each active member costs a single packed int (window start << 8 | count) in a per-guild dict,
+    and expired windows are swept in bulk so memory stays bounded by recently active members.
+    '''
+    __slots__ = 'rate', 'per', '_rates', '_windows', '_next_sweep', 'hits', 'limited', 'expiries'
+
+    def __init__(self, rate: int = 10, per: int = 120):
+        self._check_rate(rate, per)
+        self.rate: int = rate
+        self.per: int = per
+        self._rates: dict[int, tuple[int, int]] = {}  # guild_id -> (rate, per) overrides
+        self._windows: dict[int, dict[int, int]] = {}  # guild_id -> member_id -> packed window
+        self._next_sweep: int = int(time.monotonic()) + per
+
+        # Metrics
+        self.hits: int = 0
+        self.limited: int = 0
+        self.expiries: int = 0
+
+    @staticmethod
+    def _check_rate(rate: int, per: int):
+        # The count has 8 bits in a packed window
+        if not 0 < rate < 256:
+            raise ValueError('rate must be between 1 and 255')
+        if per <= 0:
+            raise ValueError('per must be positive')
+
+    def set_rate(self, guild_id: int, rate: int, per: int):
+        self._check_rate(rate, per)
+        self._rates[guild_id] = (rate, per)
+
+    def discard(self, guild_id: int):
+        '''Forgets the rate override and windows of a guild'''
+        self._rates.pop(guild_id, None)
+        self._windows.pop(guild_id, None)
+
+    def get_rate(self, guild_id: int) -> tuple[int, int]:
+        return self._rates.get(guild_id, (self.rate, self.per))
+
+    def hit(self, guild_id: int, member_id: int) -> bool:
+        '''Records a message and returns whether it is within the rate limit'''
+        now = int(time.monotonic())
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+        rate, per = self.get_rate(guild_id)
+        windows = self._windows.setdefault(guild_id, {})
+        window = windows.get(member_id)
+        if window is None or now - (window >> 8) >= per:
+            windows[member_id] = (now << 8) | 1
+        elif window & 0xFF < rate:
+            windows[member_id] = window + 1
+        else:
+            self.limited += 1
+            return False
+
+        self.hits += 1
+        return True
+
+    def sweep(self, now: int | None = None):
+        '''Drops every expired window'''
+        now = int(time.monotonic()) if now is None else now
+        for guild_id in list(self._windows):
+            _, per = self.get_rate(guild_id)
+            windows = self._windows[guild_id]
+            expired = [member_id for member_id, window in windows.items() if now - (window >> 8) >= per]
+            for member_id in expired:
+                del windows[member_id]
+            self.expiries += len(expired)
+
+            if not windows:
+                del self._windows[guild_id]
+
+        self._next_sweep = now + self.per
+
+    def __len__(self) -> int:
+        return sum(len(windows) for windows in self._windows.values())
 
 
 @dataclass
@@ -51,7 +306,7 @@ class Rank:
 
     def __eq__(self, other: Rank) -> bool:
         # Guarantees that two ranks never have the same role or level
-        return self.id is other.id or self.level is other.level
+        return self.id == other.id or self.level == other.level
 
     def __ge__(self, other: Rank) -> bool:
         return self.level >= other.level
@@ -61,23 +316,33 @@ class Rank:
 
 
 class Ranks(aobject):
-    __slots__ = '_bot', 'guild_id'
-    _ranks: list[Rank] = []  # Ascending order by level, implemented as a heapq
+    __slots__ = '_bot', 'guild_id', '_ranks', '_levels', '_role_ids'
 
-    async def __init__(self, bot: Tau, guild_id: int):
+    async def __init__(self, bot: Tau, guild_id: int, role_ids: list[int] | None = None, levels: list[int] | None = None):
         self._bot = bot
         self.guild_id = guild_id
-        async with self._bot.pool.acquire() as con:
-            record = await con.fetchrow('SELECT role_ids, levels FROM ranks WHERE guild_id = $1 ORDER BY levels ASC', guild_id)
-            if record is not None:
-                for role_id, level in zip(record['role_ids'], record['levels']):
-                    guild = self._bot.get_guild(self.guild_id)
-                    role = guild.get_role(role_id)
-                    if role is not None:
-                        rank = Rank(role_id, level)
-                        heapq.heappush(self._ranks, rank)
-                    else:
-                        await self.remove(role)
+        self._ranks: list[Rank] = []  # Ascending order by level
+        self._levels: list[int] = []  # Parallel to _ranks, for bisecting
+        self._role_ids: frozenset[int] = frozenset()
+
+        # role_ids and levels may be preloaded by the caller to avoid a query per guild
+        if role_ids is None or levels is None:
+            async with self._bot.pool.acquire() as con:
+                record = await con.fetchrow('SELECT role_ids, levels FROM ranks WHERE guild_id = $1', guild_id)
+                if record is not None:
+                    role_ids, levels = record['role_ids'], record['levels']
+                else:
+                    role_ids, levels = [], []
+
+        guild = self._bot.get_guild(self.guild_id)
+        for role_id, level in sorted(zip(role_ids, levels), key=lambda rank: rank[1]):
+            if guild.get_role(role_id) is not None:
+                self._ranks.append(Rank(role_id, level))
+        self._reindex()
+
+        # Persist the removal of any deleted roles
+        if len(self._ranks) != len(role_ids):
+            await self._update()
 
     def ids(self) -> list[int]:
         return [rank.id for rank in self._ranks]
@@ -85,23 +350,34 @@ class Ranks(aobject):
     def levels(self) -> list[int]:
         return [rank.level for rank in self._ranks]
 
+    @property
+    def role_ids(self) -> frozenset[int]:
+        return self._role_ids
+
     def get_roles(self) -> list[discord.Role]:
         guild = self._bot.get_guild(self.guild_id)
 
-        return [guild.get_role(rank.role_id) for rank in self._ranks]
+        return [guild.get_role(rank.id) for rank in self._ranks]
+
+    def rank_for(self, level: int) -> Rank | None:
+        '''Returns the highest rank reached at a level'''
+        i = bisect_right(self._levels, level)
+        return self._ranks[i-1] if i > 0 else None
 
     async def add(self, rank: Rank):
-        heapq.heappush(self._ranks, rank)
+        insort(self._ranks, rank, key=lambda rank: rank.level)
+        self._reindex()
         await self._update()
 
-    async def remove(self, rank: Rank):
-        try:
-            self._ranks.remove(rank)
-        except ValueError:
-            pass
-
+    async def remove(self, rank: Rank | discord.Role):
+        self._ranks = [r for r in self._ranks if r.id != rank.id]
+        self._reindex()
         await self._update()
 
+    def _reindex(self):
+        self._levels = [rank.level for rank in self._ranks]
+        self._role_ids = frozenset(rank.id for rank in self._ranks)
+
     async def _update(self):
         async with self._bot.pool.acquire() as con:
             await con.execute('UPDATE ranks SET role_ids = $1, levels = $2 WHERE guild_id = $3', self.ids(), self.levels(), self.guild_id)
@@ -110,8 +386,8 @@ class Ranks(aobject):
     def enabled(self):
         return len(self._ranks) > 0
 
-    def __iter__(self) -> list[Rank]:
-        return self._ranks
+    def __iter__(self) -> Iterator[Rank]:
+        return iter(self._ranks)
 
     def __contains__(self, rank: Rank) -> bool:
         return rank in self._ranks